@@ -0,0 +1,390 @@
+import json
+import os
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+from app.configuration import json_record_store
+from app.leaderboard.leaderboard import Leaderboard, PlayerRecord, PlayerStats, MetricDataPoint, to_epoch, from_epoch
+
+ARCHIVE_FILE = "records.npy"
+STRINGS_FILE = "records.strings.json"
+# new records and strings get appended here, they move into the archive once it gets rewritten
+DELTA_FILE = "records.delta.bin"
+STRINGS_DELTA_FILE = "records.strings.delta.jsonl"
+DELTA_COMPACTION_ROWS = 100000
+
+# one fixed width row per record, player ids and names are indices into the string table
+RECORD_DTYPE = np.dtype([
+    ("player", "<i4"),
+    ("name", "<i4"),
+    ("timestamp", "<i8"),
+    ("mmr", "<i4"),
+    ("power", "<i4"),
+    ("world_rank", "<i4"),
+    ("total_wins", "<i4"),
+])
+
+# The archive is memory mapped and sorted by player and timestamp, so loading only has to calculate the player stats
+# column wise and the records of a player are a slice that gets read once they are needed.
+# Saving appends the new rows unsorted to the delta file, so a save does not depend on the size of the archive. The
+# delta only gets merged into the archive once it reached DELTA_COMPACTION_ROWS, until then loading combines the player
+# stats of both.
+# The string table is append only and always written before the rows that refer to it.
+_archive = None
+_delta = np.zeros(0, dtype=RECORD_DTYPE)
+_player_rows = {}
+_timestamp_order = np.zeros(0, dtype=np.int64)  # archive rows sorted by timestamp
+_sorted_timestamps = np.zeros(0, dtype=np.int64)
+_strings = []
+_string_ids = {}
+_datetimes = {}
+_lock = threading.Lock()
+
+
+def load_leaderboard(retention=None):
+    """ Loads only the stats of every player, their records get loaded once they are needed """
+    with _lock:
+        if not os.path.exists(ARCHIVE_FILE):
+            import_json_records()
+        open_archive()
+        if len(_delta) >= DELTA_COMPACTION_ROWS:
+            compact_archive()
+        if retention is not None:
+            prune_archive(retention)
+        return build_leaderboard(retention)
+
+
+def save_records(records, batches=()):
+    """ Appends the new records to the delta file, the archive only gets rewritten once the delta grew large """
+    global _delta
+    if not records and not batches:
+        return
+    with _lock:
+        known_strings = len(_strings)
+        rows = np.concatenate([encode_records(records)] + [encode_batch(batch) for batch in batches])
+        append_strings(known_strings)
+        append_rows(rows)
+        _delta = np.concatenate([_delta, rows])
+        _datetimes.update((timestamp, from_epoch(timestamp)) for timestamp in np.unique(rows["timestamp"]).tolist())
+        if len(_delta) >= DELTA_COMPACTION_ROWS:
+            compact_archive()
+
+
+def compact_archive():
+    """ Merges the delta into a new sorted archive """
+    global _archive
+    print(f"Merging {len(_delta)} new records into " + ARCHIVE_FILE + "...")
+    rows = np.concatenate([np.asarray(_archive), _delta]) if _archive is not None else _delta
+    _archive = None  # the memory mapped file gets replaced
+    write_archive(rows)
+    # rows that are in the archive and still in the delta after an interruption here get dropped by the next merge
+    remove_delta()
+    open_archive()
+
+
+def open_archive():
+    global _archive, _delta, _player_rows, _timestamp_order, _sorted_timestamps, _strings, _string_ids, _datetimes
+    _strings = read_strings()
+    _string_ids = {string: index for index, string in enumerate(_strings)}
+    if os.path.exists(ARCHIVE_FILE):
+        _archive = np.load(ARCHIVE_FILE, mmap_mode="r")
+    else:
+        _archive = np.zeros(0, dtype=RECORD_DTYPE)
+    _delta = read_delta()
+
+    players = _archive["player"]
+    starts = player_starts(players)
+    ends = np.append(starts[1:], len(players))
+    _player_rows = {_strings[player]: (start, end)
+                    for player, start, end in zip(players[starts].tolist(), starts.tolist(), ends.tolist())}
+    # index for snapshot lookups, the archive itself is sorted by player
+    timestamps = _archive["timestamp"]
+    _timestamp_order = np.argsort(timestamps, kind="stable")
+    _sorted_timestamps = timestamps[_timestamp_order]
+    _datetimes = {timestamp: from_epoch(timestamp)
+                  for timestamp in np.unique(np.concatenate([_archive["timestamp"], _delta["timestamp"]])).tolist()}
+
+
+def player_starts(players):
+    if len(players) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.append(True, players[1:] != players[:-1]))
+
+
+def summarise(rows):
+    """ Latest row and the metric maxima and minima of every player, the rows have to be sorted by player and time """
+    starts = player_starts(rows["player"])
+    last_rows = rows[np.append(starts[1:], len(rows)) - 1] if len(rows) else rows[:0]
+    maxima = [np.maximum.reduceat(rows[c], starts) for c in ("mmr", "power", "total_wins")]
+    minima = [np.minimum.reduceat(rows[c], starts) for c in ("mmr", "power", "total_wins")]
+    return last_rows, maxima, minima
+
+
+def player_summaries():
+    """ Summaries of the archive and the delta rows, combined per player """
+    last_rows, maxima, minima = summarise(_archive)
+    if len(_delta) == 0:
+        return last_rows, maxima, minima
+    delta_last_rows, delta_maxima, delta_minima = summarise(_delta[np.lexsort((_delta["timestamp"], _delta["player"]))])
+    # at most two summaries per player, the archive one first
+    rows = np.concatenate([last_rows, delta_last_rows])
+    order = np.lexsort((rows["timestamp"], rows["player"]))
+    rows = rows[order]
+    starts = player_starts(rows["player"])
+    maxima = [np.maximum.reduceat(np.concatenate(columns)[order], starts) for columns in zip(maxima, delta_maxima)]
+    minima = [np.minimum.reduceat(np.concatenate(columns)[order], starts) for columns in zip(minima, delta_minima)]
+    return rows[np.append(starts[1:], len(rows)) - 1], maxima, minima
+
+
+def build_leaderboard(retention=None):
+    """ Calculates the stats of all players at once from the archive and delta columns """
+    leaderboard = Leaderboard()
+    if len(_archive) == 0 and len(_delta) == 0:
+        return leaderboard
+
+    last_rows, (max_mmr, max_power, max_total_wins), (min_mmr, min_power, min_total_wins) = player_summaries()
+
+    names = defaultdict(list)
+    name_keys = np.unique(np.concatenate([(rows["player"].astype(np.int64) << 32) | rows["name"]
+                                          for rows in (_archive, _delta)]))
+    for player, name in zip((name_keys >> 32).tolist(), (name_keys & 0xFFFFFFFF).tolist()):
+        names[player].append(_strings[name])
+
+    columns = zip(last_rows["player"].tolist(), last_rows["timestamp"].tolist(), last_rows["name"].tolist(),
+                  last_rows["mmr"].tolist(), last_rows["power"].tolist(), last_rows["world_rank"].tolist(),
+                  last_rows["total_wins"].tolist(), max_mmr.tolist(), max_power.tolist(), max_total_wins.tolist(),
+                  min_mmr.tolist(), min_power.tolist(), min_total_wins.tolist())
+    for (player, last_timestamp, name, mmr, power, world_rank, total_wins, max_mmr, max_power, max_total_wins, min_mmr,
+         min_power, min_total_wins) in columns:
+        player_id = _strings[player]
+        current_record = PlayerRecord(id=player_id, timestamp=_datetimes[last_timestamp], name=_strings[name],
+                                      metrics=MetricDataPoint(mmr, power, world_rank, total_wins))
+        leaderboard.players[player_id] = PlayerStats.from_summary(
+            current_record,
+            aliases=[alias for alias in names[player] if alias != current_record.name],
+            max_metrics=MetricDataPoint(max_mmr, max_power, total_wins=max_total_wins),
+            min_metrics=MetricDataPoint(min_mmr, min_power, total_wins=min_total_wins),
+            record_loader=load_records
+        )
+    # the records of dropped snapshots that are kept for the player stats do not count as snapshot
+    snapshot_timestamps = _datetimes.values()
+    leaderboard.snapshot_timestamps.update(
+        retention.kept_timestamps(snapshot_timestamps) if retention is not None else snapshot_timestamps)
+    leaderboard.snapshot_loader = load_snapshot
+    leaderboard.snapshot_columns_loader = load_snapshot_columns
+    return leaderboard
+
+
+def prune_archive(retention):
+    """ Rewrites the archive without the records of dropped snapshots, except the ones the player stats need """
+    global _archive
+    rows = _archive
+    epochs = {timestamp: epoch for epoch, timestamp in _datetimes.items()}
+    keep = np.isin(rows["timestamp"], [epochs[t] for t in retention.kept_timestamps(epochs.keys())])
+    if keep.all():
+        return
+
+    starts = player_starts(rows["player"])
+    ends = np.append(starts[1:], len(rows))
+    for column in ("mmr", "power", "total_wins"):
+        for reduce in (np.maximum, np.minimum):
+            keep |= rows[column] == np.repeat(reduce.reduceat(rows[column], starts), ends - starts)
+    keep[ends - 1] = True  # latest record of every player
+    _, first_names = np.unique((rows["player"].astype(np.int64) << 32) | rows["name"], return_index=True)
+    keep[first_names] = True
+    if keep.all():
+        return
+    print(f"Removed {len(rows) - np.count_nonzero(keep)} records of old snapshots")
+    kept_rows = np.array(rows[keep])
+    # no reference to the memory mapped file may be left, it can not be replaced on windows otherwise
+    del rows
+    _archive = None
+    write_archive(kept_rows)
+    open_archive()
+
+
+def load_records(player_id):
+    with _lock:
+        start, end = _player_rows.get(player_id, (0, 0))
+        rows = _archive[start:end]
+        if player_id in _string_ids and len(_delta):
+            delta_rows = _delta[_delta["player"] == _string_ids[player_id]]
+            if len(delta_rows):
+                rows = np.concatenate([rows, delta_rows])
+                # sorted by time, rows left in the delta by an interrupted compaction are only returned once
+                rows = rows[np.unique(rows["timestamp"], return_index=True)[1]]
+        return decode_rows(rows)
+
+
+def load_snapshot(timestamp):
+    """ Returns the records of all players in the snapshot """
+    with _lock:
+        epoch = to_epoch(timestamp)
+        start = np.searchsorted(_sorted_timestamps, epoch, side="left")
+        end = np.searchsorted(_sorted_timestamps, epoch, side="right")
+        # in archive order, so the memory mapped rows are read front to back
+        rows = _archive[np.sort(_timestamp_order[start:end])]
+        delta_rows = _delta[_delta["timestamp"] == epoch]
+        if len(delta_rows):
+            rows = np.concatenate([rows, delta_rows])
+            rows = rows[np.unique(rows["player"], return_index=True)[1]]
+        return decode_rows(rows)
+
+
+def load_snapshot_columns(start, end):
+    """ Player ids, epoch timestamps, mmr, power and total wins of all records from start to end (both included) """
+    with _lock:
+        first = np.searchsorted(_sorted_timestamps, to_epoch(start), side="left")
+        last = np.searchsorted(_sorted_timestamps, to_epoch(end), side="right")
+        rows = _archive[np.sort(_timestamp_order[first:last])]
+        delta_rows = _delta[(_delta["timestamp"] >= to_epoch(start)) & (_delta["timestamp"] <= to_epoch(end))]
+        if len(delta_rows):
+            rows = unique_rows(np.concatenate([rows, delta_rows]))
+        return ([_strings[player] for player in rows["player"].tolist()],
+                *(rows[column].astype(np.int64) for column in ("timestamp", "mmr", "power", "total_wins")))
+
+
+def decode_rows(rows):
+    return [PlayerRecord(id=_strings[player], timestamp=_datetimes[timestamp], name=_strings[name],
+                         metrics=MetricDataPoint(mmr, power, world_rank, total_wins))
+            for player, timestamp, name, mmr, power, world_rank, total_wins in zip(
+                rows["player"].tolist(), rows["timestamp"].tolist(), rows["name"].tolist(), rows["mmr"].tolist(),
+                rows["power"].tolist(), rows["world_rank"].tolist(), rows["total_wins"].tolist())]
+
+
+def encode_records(records):
+    rows = np.zeros(len(records), dtype=RECORD_DTYPE)
+    rows["player"] = [string_id(r.id) for r in records]
+    rows["name"] = [string_id(r.name) for r in records]
+    rows["timestamp"] = [to_epoch(r.timestamp) for r in records]
+    rows["mmr"] = [r.metrics.mmr for r in records]
+    rows["power"] = [r.metrics.power for r in records]
+    rows["world_rank"] = [r.metrics.world_rank or 0 for r in records]
+    rows["total_wins"] = [r.metrics.total_wins for r in records]
+    return rows
+
+
+def encode_batch(batch):
+    rows = np.zeros(len(batch), dtype=RECORD_DTYPE)
+    rows["player"] = [string_id(player_id) for player_id in batch.ids]
+    rows["name"] = [string_id(name) for name in batch.names]
+    rows["timestamp"] = to_epoch(batch.timestamp)
+    for column in ("mmr", "power", "world_rank", "total_wins"):
+        rows[column] = getattr(batch, column)
+    return rows
+
+
+def string_id(string):
+    if string not in _string_ids:
+        _string_ids[string] = len(_strings)
+        _strings.append(string)
+    return _string_ids[string]
+
+
+def read_strings():
+    strings = []
+    if os.path.exists(STRINGS_FILE):
+        with open(STRINGS_FILE, "r", encoding="utf-8") as f:
+            try:
+                strings = json.load(f)
+            except json.JSONDecodeError:
+                print("Error loading " + STRINGS_FILE + ". Using empty leaderboard.")
+    if os.path.exists(STRINGS_DELTA_FILE):
+        with open(STRINGS_DELTA_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    index, string = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # cut off by an interrupted save, the rows referring to it were not written either
+                if index > len(strings):
+                    print("Error loading " + STRINGS_DELTA_FILE + ". Strings are missing.")
+                    break
+                # strings that already made it into the string table are skipped
+                if index == len(strings):
+                    strings.append(string)
+    return strings
+
+
+def append_strings(start):
+    """ Appends the strings from index start to the strings delta file """
+    if start == len(_strings):
+        return
+    lines = "".join(json.dumps([index, _strings[index]], ensure_ascii=False) + "\n"
+                    for index in range(start, len(_strings)))
+    append_file(STRINGS_DELTA_FILE, lines.encode("utf-8"))
+
+
+def append_rows(rows):
+    append_file(DELTA_FILE, rows.tobytes())
+
+
+def append_file(path, data):
+    with open(path, "ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_delta():
+    if not os.path.exists(DELTA_FILE):
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    with open(DELTA_FILE, "rb") as f:
+        data = f.read()
+    # a row cut off by an interrupted save is ignored
+    return np.frombuffer(data[:len(data) - len(data) % RECORD_DTYPE.itemsize], dtype=RECORD_DTYPE).copy()
+
+
+def remove_delta():
+    for path in (DELTA_FILE, STRINGS_DELTA_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def unique_rows(rows):
+    """ Rows sorted by player and timestamp, a record that is in the archive and the delta is only kept once """
+    rows = rows[np.lexsort((rows["timestamp"], rows["player"]))]
+    # a record can be in the archive and the delta if merging them got interrupted
+    duplicates = (rows["player"][1:] == rows["player"][:-1]) & (rows["timestamp"][1:] == rows["timestamp"][:-1])
+    return rows[np.append(True, ~duplicates)] if len(rows) else rows
+
+
+def write_archive(rows):
+    global _archive
+    rows = unique_rows(rows)
+    write_atomic(STRINGS_FILE, lambda f: f.write(json.dumps(_strings, ensure_ascii=False).encode("utf-8")))
+    _archive = None  # a memory mapped file can not be replaced on windows
+    write_atomic(ARCHIVE_FILE, lambda f: np.save(f, rows))
+
+
+def write_atomic(path, write):
+    temp_file = path + ".tmp"
+    with open(temp_file, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, path)
+
+
+def import_json_records():
+    """ Converts the records of the json store into a new archive, records already saved to the delta are kept """
+    global _strings, _string_ids, _datetimes
+    print("Converting " + json_record_store.RECORDS_FILE + " into " + ARCHIVE_FILE + "...")
+    # the delta refers to the string table that gets replaced, so its records are decoded first
+    _strings = read_strings()
+    delta = read_delta()
+    _datetimes = {timestamp: from_epoch(timestamp) for timestamp in np.unique(delta["timestamp"]).tolist()}
+    records = decode_rows(delta)
+    _strings, _string_ids = [], {}
+    leaderboard = json_record_store.load_leaderboard()
+    records.extend(record for player in leaderboard.players.values() for record in player.records)
+    write_archive(encode_records(records))
+    remove_delta()
+
+
+def export_json_records():
+    """ Converts the archive back into the records file of the json store """
+    leaderboard = load_leaderboard()
+    print("Converting " + ARCHIVE_FILE + " into " + json_record_store.RECORDS_FILE + "...")
+    json_record_store.export_records(leaderboard)
@@ -0,0 +1,264 @@
+import json
+import os
+import re
+import shutil
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+from app.leaderboard.leaderboard import Leaderboard, PlayerRecord, MetricDataPoint, to_epoch, from_epoch
+from app.leaderboard.retention import prune_leaderboard
+
+RECORDS_FILE = "records.json"
+RECORDS_BACKUP_FILE = "records.v1.json"
+RECORDS_VERSION = 2
+JOURNAL_FILE = "records.journal"
+COMPACTING_JOURNAL_FILE = "records.journal.compacting"
+COMPACTION_SIZE = 8 * 1024 * 1024  # journal bytes before it gets compacted into the records file
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+GENERATION_PATTERN = re.compile(rb'"generation": (\d+)')
+
+# New records are appended to the journal, one line per snapshot. Once the journal grows too big it is renamed and
+# compacted into the records file in the background while a new journal takes further records. Every compaction
+# increments the generation of the records file, journals older than it were already compacted and get ignored.
+# Compactions also drop the snapshots the retention policy does not keep.
+_journal_lock = threading.Lock()
+_compaction = None
+_retention = None
+
+
+def load_leaderboard(retention=None):
+    """ Loads the records file and replays all journals that were not compacted into it yet """
+    global _retention
+    _retention = retention
+    data = read_records_file()
+    leaderboard = parse_leaderboard(data)
+    generation = data.get("generation", 0)
+    if data.get("players") and data.get("version", 1) < RECORDS_VERSION:
+        migrate_records_file(leaderboard, generation)
+    for path in (COMPACTING_JOURNAL_FILE, JOURNAL_FILE):
+        replay_journal(path, leaderboard, generation)
+    leaderboard.mark_saved()
+
+    if os.path.exists(COMPACTING_JOURNAL_FILE):
+        start_compaction()  # finish a compaction that got interrupted
+    elif retention is not None and prune_leaderboard(leaderboard, retention):
+        start_compaction()  # rewrite the records file without the dropped snapshots
+    return leaderboard
+
+
+def save_records(records, batches=()):
+    """ Appends new records and snapshot batches to the journal """
+    if not records and not batches:
+        return
+    append_journal(records, batches)
+
+    if os.path.getsize(JOURNAL_FILE) > COMPACTION_SIZE:
+        start_compaction()
+
+
+def read_records_file():
+    if os.path.exists(RECORDS_FILE):
+        with open(RECORDS_FILE, "r", encoding="utf-8") as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                print("Error loading " + RECORDS_FILE + ". Using empty leaderboard.")
+    return {}
+
+
+def read_generation():
+    """ Reads the generation from the head of the records file without parsing all of it """
+    if not os.path.exists(RECORDS_FILE):
+        return 0
+    with open(RECORDS_FILE, "rb") as f:
+        match = GENERATION_PATTERN.search(f.read(64))
+    return int(match.group(1)) if match else 0
+
+
+def parse_leaderboard(data):
+    if data.get("version", 1) < RECORDS_VERSION:
+        return parse_v1_leaderboard(data)
+    leaderboard = Leaderboard()
+    players = data["players"]
+    for snapshot in data["snapshots"]:
+        timestamp = from_epoch(snapshot["timestamp"])
+        for player_index, name_index, mmr, power, world_rank, total_wins in snapshot["rows"]:
+            player_id, names = players[player_index]
+            metrics = MetricDataPoint(mmr=mmr, power=power, world_rank=world_rank, total_wins=total_wins)
+            leaderboard.add_record(PlayerRecord(id=player_id, timestamp=timestamp, metrics=metrics,
+                                                name=names[name_index]))
+    return leaderboard
+
+
+def parse_v1_leaderboard(data):
+    """ Old layout that repeats the id, name and formatted timestamp in every record """
+    leaderboard = Leaderboard()
+    timestamps = {}
+    for player_data in data.get("players", {}).values():
+        player_records = player_data.get("records", [])
+        for record in player_records:
+            if record["timestamp"] not in timestamps:
+                timestamps[record["timestamp"]] = datetime.strptime(record["timestamp"], TIMESTAMP_FORMAT)
+            record_obj = PlayerRecord(
+                id=record["id"],
+                timestamp=timestamps[record["timestamp"]],
+                metrics=MetricDataPoint(
+                    mmr=record["metrics"]["mmr"],
+                    power=record["metrics"]["power"],
+                    world_rank=record["metrics"].get("world_rank", 0),
+                    total_wins=record["metrics"].get("total_wins", 0),
+                ),
+                name=record["name"],
+            )
+            leaderboard.add_record(record_obj)
+    return leaderboard
+
+
+def write_records_file(leaderboard, generation):
+    """
+    Every snapshot timestamp is stored once in epoch seconds and every player once with its name history,
+    the rows of a snapshot only refer to them by index.
+    """
+    players = []
+    snapshots = defaultdict(list)
+    for player_id, player in leaderboard.players.items():
+        names = {}
+        for record in player.records:
+            name_index = names.setdefault(record.name, len(names))
+            snapshots[to_epoch(record.timestamp)].append([
+                len(players), name_index, record.metrics.mmr, record.metrics.power, record.metrics.world_rank,
+                record.metrics.total_wins
+            ])
+        players.append([player_id, list(names)])
+    data = {
+        "generation": generation,
+        "version": RECORDS_VERSION,
+        "players": players,
+        "snapshots": [{"timestamp": timestamp, "rows": rows} for timestamp, rows in sorted(snapshots.items())],
+    }
+    # never touch the existing history until the new file is complete
+    temp_file = RECORDS_FILE + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, RECORDS_FILE)
+
+
+def migrate_records_file(leaderboard, generation):
+    """ Rewrites the records file in the current layout, the old file is kept as backup """
+    print("Migrating " + RECORDS_FILE + " to version " + str(RECORDS_VERSION) + "...")
+    with _journal_lock:
+        shutil.copyfile(RECORDS_FILE, RECORDS_BACKUP_FILE)
+        write_records_file(leaderboard, generation)
+
+
+def replay_journal(path, leaderboard, generation):
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        header = read_journal_line(f.readline())
+        if header is None or header.get("generation", 0) < generation:
+            return  # already compacted into the records file
+        for line in f:
+            entry = read_journal_line(line)
+            if entry is None:
+                continue  # torn write of a crash
+            timestamp = datetime.strptime(entry["timestamp"], TIMESTAMP_FORMAT)
+            for player_id, name, mmr, power, world_rank, total_wins in entry["records"]:
+                metrics = MetricDataPoint(mmr=mmr, power=power, world_rank=world_rank, total_wins=total_wins)
+                leaderboard.add_record(PlayerRecord(id=player_id, timestamp=timestamp, metrics=metrics, name=name))
+
+
+def read_journal_line(line):
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError:
+        return None
+
+
+def journal_generation(path):
+    with open(path, "r", encoding="utf-8") as f:
+        header = read_journal_line(f.readline())
+    return header.get("generation", 0) if header else 0
+
+
+def append_journal(records, batches=()):
+    snapshots = defaultdict(list)
+    for record in records:
+        snapshots[record.timestamp].append([record.id, record.name, record.metrics.mmr, record.metrics.power,
+                                            record.metrics.world_rank, record.metrics.total_wins])
+    for batch in batches:
+        snapshots[batch.timestamp].extend(map(list, zip(batch.ids, batch.names, batch.mmr.tolist(),
+                                                        batch.power.tolist(), batch.world_rank.tolist(),
+                                                        batch.total_wins.tolist())))
+    lines = "".join(
+        json.dumps({"timestamp": timestamp.strftime(TIMESTAMP_FORMAT), "records": rows}, ensure_ascii=False) + "\n"
+        for timestamp, rows in sorted(snapshots.items())
+    )
+    with _journal_lock:
+        if not os.path.exists(JOURNAL_FILE):
+            create_journal(read_generation())
+        with open(JOURNAL_FILE, "r+b") as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # drop the torn line a crash left behind, so it does not swallow the next one
+                    f.seek(0)
+                    f.truncate(f.read().rfind(b"\n") + 1)
+            if f.seek(0, os.SEEK_END) == 0:
+                f.write(journal_header(read_generation()))
+            f.write(lines.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def create_journal(generation):
+    with open(JOURNAL_FILE, "wb") as f:
+        f.write(journal_header(generation))
+
+
+def journal_header(generation):
+    return (json.dumps({"generation": generation}) + "\n").encode("utf-8")
+
+
+def start_compaction():
+    global _compaction
+    with _journal_lock:
+        if _compaction is not None and _compaction.is_alive():
+            return
+        if not os.path.exists(COMPACTING_JOURNAL_FILE):
+            if not os.path.exists(JOURNAL_FILE):
+                create_journal(read_generation())
+            os.replace(JOURNAL_FILE, COMPACTING_JOURNAL_FILE)
+            create_journal(journal_generation(COMPACTING_JOURNAL_FILE) + 1)
+        _compaction = threading.Thread(target=compact)
+        _compaction.start()
+
+
+def compact():
+    """ Merges the renamed journal into the records file """
+    data = read_records_file()
+    generation = journal_generation(COMPACTING_JOURNAL_FILE)
+    if generation >= data.get("generation", 0):
+        leaderboard = parse_leaderboard(data)
+        replay_journal(COMPACTING_JOURNAL_FILE, leaderboard, generation)
+        if _retention is not None:
+            prune_leaderboard(leaderboard, _retention)
+        # the new journal already has the next generation
+        write_records_file(leaderboard, generation + 1)
+    os.remove(COMPACTING_JOURNAL_FILE)
+    print("Compacted record journal into " + RECORDS_FILE)
+
+
+def export_records(leaderboard):
+    """ Replaces all stored records with the ones of the leaderboard """
+    with _journal_lock:
+        if _compaction is not None:
+            _compaction.join()
+        journals = [path for path in (COMPACTING_JOURNAL_FILE, JOURNAL_FILE) if os.path.exists(path)]
+        # a newer generation than all journals, so they are ignored even if removing them fails
+        write_records_file(leaderboard, max([read_generation()] + [journal_generation(p) for p in journals]) + 1)
+        for path in journals:
+            os.remove(path)
@@ -1,23 +1,30 @@
 import json
 import os
-from datetime import datetime
 from app import statics
 import numpy as np
-from app.leaderboard.leaderboard import Leaderboard, PlayerRecord, MetricDataPoint
+from app.configuration import json_record_store, sqlite_record_store, archive_record_store
+from app.leaderboard.retention import RetentionPolicy
 
-RECORDS_FILE = "records.json"
 SETTINGS_FILE = "settings.json"
+LOG_CHECKPOINTS_FILE = "log_checkpoints.json"
 
 __settings = None
+__record_store = None
 
 
 class Settings:
-    def __init__(self, game_dir=None, fuzzy_threshold=None, favorite_bets=None, click_delay=None, window_opacity=None):
+    def __init__(self, game_dir=None, fuzzy_threshold=None, favorite_bets=None, click_delay=None, window_opacity=None,
+                 import_workers=None, record_storage=None, retention_full_days=None, retention_hourly_days=None):
         self.game_dir = game_dir or "C:\\Program Files(x86)\\Steam\\steamapps\\common\\Mechabellum"
         self.fuzzy_threshold = fuzzy_threshold or 75
         self.favorite_bets = favorite_bets or [1, 3, 5 ,10, 200]
         self.click_delay = click_delay or 0.2
         self.window_opacity = window_opacity or 100
+        self.import_workers = import_workers or 1
+        self.record_storage = record_storage or "json"
+        # None keeps every snapshot (or every hourly one after retention_full_days)
+        self.retention_full_days = retention_full_days
+        self.retention_hourly_days = retention_hourly_days
 
     def to_dict(self):
         """Convert settings object to dictionary."""
@@ -27,6 +34,10 @@ class Settings:
             "favorite_bets": self.favorite_bets,
             "click_delay": self.click_delay,
             "window_opacity": self.window_opacity,
+            "import_workers": self.import_workers,
+            "record_storage": self.record_storage,
+            "retention_full_days": self.retention_full_days,
+            "retention_hourly_days": self.retention_hourly_days,
         }
 
     @classmethod
@@ -37,7 +48,11 @@ class Settings:
             fuzzy_threshold=data.get("fuzzy_threshold"),
             favorite_bets=data.get("favorite_bets"),
             click_delay=data.get("click_delay"),
-            window_opacity=data.get("window_opacity")
+            window_opacity=data.get("window_opacity"),
+            import_workers=data.get("import_workers"),
+            record_storage=data.get("record_storage"),
+            retention_full_days=data.get("retention_full_days"),
+            retention_hourly_days=data.get("retention_hourly_days")
         )
 
     def save(self, path="settings.json"):
@@ -80,59 +95,48 @@ def game_log_filepath():
 def window_opacity():
     return np.clip(get_settings().window_opacity / 100.0, 0.1, 100)
 
+def record_store():
+    """ The store is chosen on first use, so records are saved where they were loaded from until the app restarts """
+    global __record_store
+    if __record_store is None:
+        if get_settings().record_storage == "sqlite":
+            __record_store = sqlite_record_store
+        elif get_settings().record_storage == "archive":
+            __record_store = archive_record_store
+        else:
+            __record_store = json_record_store
+    return __record_store
+
+
+def retention_policy():
+    """ None if retention is turned off and all snapshots are kept """
+    if get_settings().retention_full_days is None:
+        return None
+    return RetentionPolicy(get_settings().retention_full_days, get_settings().retention_hourly_days)
+
+
 def load_leaderboard():
-    if os.path.exists(RECORDS_FILE):
-        with open(RECORDS_FILE, "r", encoding="utf-8") as f:
+    return record_store().load_leaderboard(retention_policy())
+
+
+def save_records(records, batches=()):
+    record_store().save_records(records, batches)
+
+
+def load_log_checkpoints():
+    if os.path.exists(LOG_CHECKPOINTS_FILE):
+        with open(LOG_CHECKPOINTS_FILE, "r", encoding="utf-8") as f:
             try:
-                data = json.load(f)
-                return parse_leaderboard(data)
+                return json.load(f)
             except json.JSONDecodeError:
-                print("Error loading " + RECORDS_FILE + ". Using empty leaderboard.")
-    return Leaderboard()
-
-
-def parse_leaderboard(data):
-    leaderboard = Leaderboard()
-    for player_data in data.get("players", {}).values():
-        player_records = player_data.get("records", [])
-        for record in player_records:
-            record_obj = PlayerRecord(
-                id=record["id"],
-                timestamp=datetime.strptime(record["timestamp"], "%Y-%m-%d %H:%M:%S"),
-                metrics=MetricDataPoint(
-                    mmr=record["metrics"]["mmr"],
-                    power=record["metrics"]["power"],
-                    world_rank=record["metrics"].get("world_rank", 0),
-                    total_wins=record["metrics"].get("total_wins", 0),
-                ),
-                name=record["name"],
-            )
-            leaderboard.add_record(record_obj)
-    return leaderboard
-
-
-def save_leaderboard(leaderboard):
-    data = {
-        "players": {
-            player_id: {
-                "current_name": player.current_name,
-                "records": [
-                    {
-                        "id": record.id,
-                        "timestamp": record.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                        "metrics": {
-                            "mmr": record.metrics.mmr,
-                            "power": record.metrics.power,
-                            "world_rank": record.metrics.world_rank,
-                            "total_wins": record.metrics.total_wins,
-                        },
-                        "name": record.name,
-                    }
-                    for record in player.records
-                ],
-            }
-            for player_id, player in leaderboard.players.items()
-        }
-    }
-    with open(RECORDS_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4)
+                print("Error loading " + LOG_CHECKPOINTS_FILE + ". Importing all logs again.")
+    return {}
+
+
+def save_log_checkpoints(checkpoints):
+    temp_file = LOG_CHECKPOINTS_FILE + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump(checkpoints, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, LOG_CHECKPOINTS_FILE)
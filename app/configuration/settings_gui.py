@@ -56,6 +56,22 @@ class SettingsUI(QWidget):
         self.click_delay_input = QLineEdit(str(self.settings.click_delay))
         layout.addLayout(self._labeled_field("Click Delay (seconds):", self.click_delay_input))
 
+        # Import Workers
+        self.import_workers_input = QLineEdit(str(self.settings.import_workers))
+        layout.addLayout(self._labeled_field("Log Import Workers (processes):", self.import_workers_input))
+
+        # Record Storage
+        self.record_storage_input = QLineEdit(self.settings.record_storage)
+        layout.addLayout(self._labeled_field("Record Storage (json/sqlite/archive, after restart):", self.record_storage_input))
+
+        # Retention, empty fields keep everything
+        self.retention_full_days_input = QLineEdit(self._optional_text(self.settings.retention_full_days))
+        layout.addLayout(self._labeled_field("Keep All Snapshots (days, empty = forever):",
+                                             self.retention_full_days_input))
+        self.retention_hourly_days_input = QLineEdit(self._optional_text(self.settings.retention_hourly_days))
+        layout.addLayout(self._labeled_field("Keep Hourly Snapshots (days, empty = forever):",
+                                             self.retention_hourly_days_input))
+
         # Buttons
         button_layout = QHBoxLayout()
         save_button = QPushButton("Save")
@@ -74,6 +90,12 @@ class SettingsUI(QWidget):
         hbox.addWidget(widget)
         return hbox
 
+    def _optional_text(self, value):
+        return "" if value is None else str(value)
+
+    def _optional_int(self, text):
+        return int(text) if text.strip() else None
+
     def browse_game_dir(self):
         directory = QFileDialog.getExistingDirectory(self, "Select Game Directory", self.game_dir_input.text())
         if directory:
@@ -90,6 +112,20 @@ class SettingsUI(QWidget):
 
             bets = [int(x.strip()) for x in self.bets_input.text().split(",")]
             delay = float(self.click_delay_input.text())
+            import_workers = int(self.import_workers_input.text())
+            if import_workers < 1:
+                raise ValueError("Log import workers must be at least 1.")
+            record_storage = self.record_storage_input.text().strip().lower()
+            if record_storage not in ("json", "sqlite", "archive"):
+                raise ValueError("Record storage must be json, sqlite or archive.")
+            retention_full_days = self._optional_int(self.retention_full_days_input.text())
+            retention_hourly_days = self._optional_int(self.retention_hourly_days_input.text())
+            if retention_full_days is None and retention_hourly_days is not None:
+                raise ValueError("Set how long all snapshots are kept before limiting the hourly ones.")
+            if retention_full_days is not None and retention_full_days < 0:
+                raise ValueError("Snapshots can not be kept for a negative number of days.")
+            if retention_hourly_days is not None and retention_hourly_days < retention_full_days:
+                raise ValueError("Hourly snapshots must be kept at least as long as all snapshots.")
 
             # Update the global settings object (instead of creating a new one)
             updated_settings = settings.get_settings()
@@ -97,6 +133,10 @@ class SettingsUI(QWidget):
             updated_settings.window_opacity = window_opacity
             updated_settings.favorite_bets = bets
             updated_settings.click_delay = delay
+            updated_settings.import_workers = import_workers
+            updated_settings.record_storage = record_storage
+            updated_settings.retention_full_days = retention_full_days
+            updated_settings.retention_hourly_days = retention_hourly_days
             updated_settings.game_dir = self.game_dir_input.text()
 
             # Save the updated settings to the file
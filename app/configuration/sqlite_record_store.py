@@ -0,0 +1,200 @@
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+from app.configuration import json_record_store
+from app.leaderboard.leaderboard import Leaderboard, PlayerRecord, PlayerStats, MetricDataPoint, to_epoch, from_epoch
+
+RECORDS_DB_FILE = "records.db"
+MIGRATED_VERSION = 1  # user_version of databases that took over the records of the json store
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    timestamp INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS players (
+    player_id PRIMARY KEY,
+    last_timestamp INTEGER,
+    name TEXT,
+    mmr INTEGER,
+    power INTEGER,
+    world_rank INTEGER,
+    total_wins INTEGER,
+    max_mmr INTEGER,
+    max_power INTEGER,
+    max_total_wins INTEGER,
+    min_mmr INTEGER,
+    min_power INTEGER,
+    min_total_wins INTEGER
+);
+CREATE TABLE IF NOT EXISTS aliases (
+    player_id,
+    name TEXT,
+    PRIMARY KEY (player_id, name)
+);
+CREATE TABLE IF NOT EXISTS records (
+    player_id NOT NULL,
+    timestamp INTEGER NOT NULL,
+    name TEXT,
+    mmr INTEGER,
+    power INTEGER,
+    world_rank INTEGER,
+    total_wins INTEGER,
+    PRIMARY KEY (player_id, timestamp)
+);
+CREATE INDEX IF NOT EXISTS records_timestamp ON records (timestamp);
+"""
+
+# records the stats of a player depend on, the first record of every name is selected separately
+PROTECTED_RECORDS = """
+SELECT records.player_id, records.timestamp FROM records JOIN players ON players.player_id = records.player_id
+WHERE records.timestamp = players.last_timestamp
+   OR records.mmr IN (players.max_mmr, players.min_mmr)
+   OR records.power IN (players.max_power, players.min_power)
+   OR records.total_wins IN (players.max_total_wins, players.min_total_wins)
+"""
+
+# recalculates the stored stats of a player from its records
+UPDATE_PLAYER = """
+INSERT OR REPLACE INTO players
+SELECT stats.player_id, latest.timestamp, latest.name, latest.mmr, latest.power, latest.world_rank,
+       latest.total_wins, stats.max_mmr, stats.max_power, stats.max_total_wins, stats.min_mmr, stats.min_power,
+       stats.min_total_wins
+FROM (
+    SELECT player_id, MAX(timestamp) AS last_timestamp,
+           MAX(mmr) AS max_mmr, MAX(power) AS max_power, MAX(total_wins) AS max_total_wins,
+           MIN(mmr) AS min_mmr, MIN(power) AS min_power, MIN(total_wins) AS min_total_wins
+    FROM records WHERE player_id = ?
+) AS stats
+JOIN records AS latest ON latest.player_id = stats.player_id AND latest.timestamp = stats.last_timestamp
+"""
+
+# the connection is shared by the loading thread and the ui thread, which loads records on demand
+_connection = None
+_lock = threading.Lock()
+
+
+def connection():
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(RECORDS_DB_FILE, check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.executescript(SCHEMA)
+    return _connection
+
+
+def load_leaderboard(retention=None):
+    """ Loads only the stats of every player, their records get loaded once they are needed """
+    with _lock:
+        db = connection()
+        if db.execute("PRAGMA user_version").fetchone()[0] < MIGRATED_VERSION:
+            migrate_json_records()
+        if retention is not None:
+            prune_records(retention)
+
+        aliases = defaultdict(list)
+        for player_id, name in db.execute("SELECT player_id, name FROM aliases"):
+            aliases[player_id].append(name)
+
+        leaderboard = Leaderboard()
+        for (player_id, last_timestamp, name, mmr, power, world_rank, total_wins, max_mmr, max_power, max_total_wins,
+             min_mmr, min_power, min_total_wins) in db.execute("SELECT * FROM players"):
+            current_record = PlayerRecord(id=player_id, timestamp=from_epoch(last_timestamp), name=name,
+                                          metrics=MetricDataPoint(mmr, power, world_rank, total_wins))
+            leaderboard.players[player_id] = PlayerStats.from_summary(
+                current_record,
+                aliases=[alias for alias in aliases[player_id] if alias != name],
+                max_metrics=MetricDataPoint(max_mmr, max_power, total_wins=max_total_wins),
+                min_metrics=MetricDataPoint(min_mmr, min_power, total_wins=min_total_wins),
+                record_loader=load_records
+            )
+        leaderboard.snapshot_timestamps.update(
+            from_epoch(timestamp) for (timestamp,) in db.execute("SELECT timestamp FROM snapshots"))
+        leaderboard.snapshot_loader = load_snapshot
+        leaderboard.snapshot_columns_loader = load_snapshot_columns
+    return leaderboard
+
+
+def load_records(player_id):
+    with _lock:
+        rows = connection().execute(
+            "SELECT timestamp, name, mmr, power, world_rank, total_wins FROM records WHERE player_id = ? "
+            "ORDER BY timestamp", (player_id,)).fetchall()
+    return [PlayerRecord(id=player_id, timestamp=from_epoch(timestamp), name=name,
+                         metrics=MetricDataPoint(mmr, power, world_rank, total_wins))
+            for timestamp, name, mmr, power, world_rank, total_wins in rows]
+
+
+def load_snapshot(timestamp):
+    """ Returns the records of all players in the snapshot """
+    with _lock:
+        rows = connection().execute(
+            "SELECT player_id, name, mmr, power, world_rank, total_wins FROM records WHERE timestamp = ?",
+            (to_epoch(timestamp),)).fetchall()
+    return [PlayerRecord(id=player_id, timestamp=timestamp, name=name,
+                         metrics=MetricDataPoint(mmr, power, world_rank, total_wins))
+            for player_id, name, mmr, power, world_rank, total_wins in rows]
+
+
+def load_snapshot_columns(start, end):
+    """ Player ids, epoch timestamps, mmr, power and total wins of all records from start to end (both included) """
+    with _lock:
+        rows = connection().execute(
+            "SELECT player_id, timestamp, mmr, power, total_wins FROM records WHERE timestamp BETWEEN ? AND ?",
+            (to_epoch(start), to_epoch(end))).fetchall()
+    columns = np.array([row[1:] for row in rows], dtype=np.int64).reshape(-1, 4)
+    return [row[0] for row in rows], *(columns[:, column] for column in range(4))
+
+
+def save_records(records, batches=()):
+    if not records and not batches:
+        return
+    with _lock:
+        insert_records(records, batches)
+
+
+def insert_records(records, batches=()):
+    rows = [(r.id, to_epoch(r.timestamp), r.name, r.metrics.mmr, r.metrics.power, r.metrics.world_rank,
+             r.metrics.total_wins) for r in records]
+    for batch in batches:
+        rows.extend(zip(batch.ids, [to_epoch(batch.timestamp)] * len(batch), batch.names, batch.mmr.tolist(),
+                        batch.power.tolist(), batch.world_rank.tolist(), batch.total_wins.tolist()))
+    db = connection()
+    with db:  # one transaction, a crash never leaves half a save behind
+        db.executemany("INSERT OR IGNORE INTO snapshots VALUES (?)", {(row[1],) for row in rows})
+        db.executemany("INSERT OR IGNORE INTO records VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        db.executemany("INSERT OR IGNORE INTO aliases VALUES (?, ?)", {(row[0], row[2]) for row in rows})
+        db.executemany(UPDATE_PLAYER, [(player_id,) for player_id in {row[0] for row in rows}])
+
+
+def prune_records(retention):
+    """ Deletes the records of the snapshots the retention policy drops, except the ones the player stats need """
+    db = connection()
+    timestamps = {from_epoch(timestamp): timestamp for (timestamp,) in db.execute("SELECT timestamp FROM snapshots")}
+    dropped = [timestamps[t] for t in timestamps.keys() - retention.kept_timestamps(timestamps.keys())]
+    if not dropped:
+        return
+    protected = set(db.execute("SELECT player_id, MIN(timestamp) FROM records GROUP BY player_id, name"))
+    protected.update(db.execute(PROTECTED_RECORDS))
+    removed = [row for timestamp in dropped
+               for row in db.execute("SELECT player_id, timestamp FROM records WHERE timestamp = ?", (timestamp,))
+               if row not in protected]
+    with db:
+        db.executemany("DELETE FROM records WHERE player_id = ? AND timestamp = ?", removed)
+        db.executemany("DELETE FROM snapshots WHERE timestamp = ?", [(timestamp,) for timestamp in dropped])
+    if removed:
+        print(f"Removed {len(removed)} records of old snapshots")
+
+
+def migrate_json_records():
+    """ Takes over the json records once, the version marks the database as migrated even if there were none """
+    db = connection()
+    if os.path.exists(json_record_store.RECORDS_FILE) or os.path.exists(json_record_store.JOURNAL_FILE):
+        print("Migrating " + json_record_store.RECORDS_FILE + " into " + RECORDS_DB_FILE + "...")
+        leaderboard = json_record_store.load_leaderboard()
+        insert_records([record for player in leaderboard.players.values() for record in player.records])
+    with db:
+        db.execute(f"PRAGMA user_version = {MIGRATED_VERSION}")
@@ -1,9 +1,53 @@
-import math
+import bisect
+import hashlib
+import sys
+from collections import deque
+from datetime import datetime, timedelta
+from functools import lru_cache
 
+import numpy as np
+
+from app.leaderboard.name_index import NameIndex
+from app.leaderboard.retention import retained_records
+from app.leaderboard.snapshot_diff import SnapshotDiffs
 from app.statics import calculate_color
 
+EPOCH = datetime(1970, 1, 1)
+METRICS = ("mmr", "power", "total_wins")
+SNAPSHOT_MEMBER_CACHE_SIZE = 8
+SCORE_HISTORY_CHUNK = 256  # snapshots that get read and scored at once
+SCORE_HISTORY_CHUNK_ROWS = 100000  # scored rows of a chunk before later snapshots start a new one
+ROLLING_WINDOW = timedelta(days=1)
+MMR_PER_GAME = 20  # rough mmr change of a single game, the logs only tell the total wins
+# player orders of get_players, key and whether it is descending
+PLAYER_ORDERS = {
+    "score_rank": (lambda p: p.score_rank, False),
+    "mmr": (lambda p: p.current_metrics.mmr, True),
+    "power": (lambda p: p.current_metrics.power, True),
+    "wins": (lambda p: p.current_metrics.total_wins, True),
+    "world_rank": (lambda p: p.current_metrics.world_rank or 0, False),
+}
+
+
+def to_epoch(timestamp):
+    """ Seconds since epoch for the naive log timestamps (no timezone conversion) """
+    return int((timestamp - EPOCH).total_seconds())
+
+
+@lru_cache(maxsize=None)
+def from_epoch(seconds):
+    """ All records of a snapshot share one timestamp object """
+    return EPOCH + timedelta(seconds=seconds)
+
+
+def intern_string(value):
+    """ Ids and names repeat in every snapshot, interning keeps a single copy of each """
+    return sys.intern(value) if isinstance(value, str) else value
+
 
 class MetricDataPoint:
+    __slots__ = ("world_rank", "mmr", "power", "total_wins")
+
     def __init__(self, mmr: int, power: int, world_rank: int = None, total_wins: int = None):
         self.world_rank = world_rank
         self.mmr = mmr
@@ -12,31 +56,291 @@ class MetricDataPoint:
 
 
 class PlayerRecord:
+    __slots__ = ("id", "name", "metrics", "timestamp")
+
     def __init__(self, id: str, timestamp, metrics: MetricDataPoint, name: str = None):
-        self.id = id
-        self.name = name
+        self.id = intern_string(id)
+        self.name = intern_string(name)
         self.metrics = metrics
         self.timestamp = timestamp
 
 
+class SnapshotBatch:
+    """
+    All player rows of one leaderboard snapshot as columns, the timestamp is shared by every row. The leaderboard keeps
+    the batch as it is, records of its rows are only created once they are needed.
+    """
+
+    def __init__(self, timestamp, ids, names, mmr, power, world_rank, total_wins):
+        self.timestamp = timestamp
+        self.ids = list(ids)
+        self.names = list(names)
+        self.mmr = np.asarray(mmr, dtype=np.int32)
+        self.power = np.asarray(power, dtype=np.int32)
+        self.world_rank = np.asarray(world_rank, dtype=np.int32)
+        self.total_wins = np.asarray(total_wins, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern_strings(self):
+        """ Batches of import workers arrive with their own copies of the ids and names """
+        self.ids = [intern_string(player_id) for player_id in self.ids]
+        self.names = [intern_string(name) for name in self.names]
+
+    def content_digest(self):
+        """ Hash of the player rows, repeated snapshots have the same one regardless of their timestamp """
+        digest = hashlib.blake2b(repr((self.ids, self.names)).encode(), digest_size=16)
+        for column in (self.mmr, self.power, self.world_rank, self.total_wins):
+            digest.update(column.tobytes())
+        return digest.digest()
+
+    def record(self, row):
+        metrics = MetricDataPoint(int(self.mmr[row]), int(self.power[row]), int(self.world_rank[row]),
+                                  int(self.total_wins[row]))
+        return PlayerRecord(self.ids[row], self.timestamp, metrics, self.names[row])
+
+    def records(self):
+        return [self.record(row) for row in range(len(self))]
+
+
+class BatchRows:
+    """
+    The rows of snapshot batches grouped by player and sorted by time, as indices into the batches. Players whose
+    records are not needed only get their stats from summaries(), records(id) creates the records of a player.
+    """
+
+    def __init__(self, batches):
+        self.batches = batches
+        counts = [len(batch) for batch in batches]
+        player_codes, name_codes = {}, {}
+        codes = np.array([player_codes.setdefault(player_id, len(player_codes))
+                          for batch in batches for player_id in batch.ids], dtype=np.int64)
+        names = np.array([name_codes.setdefault(name, len(name_codes)) for batch in batches for name in batch.names],
+                         dtype=np.int64)
+        batch_index = np.repeat(np.arange(len(batches), dtype=np.int64), counts)
+        epochs = np.array([to_epoch(batch.timestamp) for batch in batches], dtype=np.int64)[batch_index]
+        order = np.lexsort((epochs, codes))
+        self.player_ids = list(player_codes)
+        self.names = list(name_codes)
+        self.codes = codes[order].astype(np.int32)
+        self.name_codes = names[order].astype(np.int32)
+        self.batch_index = batch_index[order].astype(np.int32)
+        self.row_index = (np.arange(len(codes)) - np.repeat(np.cumsum(counts) - counts, counts))[order].astype(np.int32)
+        # codes are numbered by first appearance, so the groups of the sorted rows are in code order
+        self.starts = np.searchsorted(self.codes, np.arange(len(self.player_ids)))
+        self.ends = np.append(self.starts[1:], len(self.codes))
+        self.player_codes = player_codes
+
+    def summaries(self):
+        """ Id, latest record, names, max metrics and min metrics of every player """
+        offsets = np.cumsum([0] + [len(batch) for batch in self.batches[:-1]])
+        rows = offsets[self.batch_index] + self.row_index
+        columns = {metric: np.concatenate([getattr(batch, metric) for batch in self.batches])[rows]
+                   for metric in METRICS}
+        maxima = {metric: np.maximum.reduceat(column, self.starts).tolist() for metric, column in columns.items()}
+        minima = {metric: np.minimum.reduceat(column, self.starts).tolist() for metric, column in columns.items()}
+        player_names = [[] for _ in self.player_ids]
+        pairs = np.unique(self.codes.astype(np.int64) * len(self.names) + self.name_codes)
+        for code, name in zip((pairs // len(self.names)).tolist(), (pairs % len(self.names)).tolist()):
+            player_names[code].append(self.names[name])
+        for code, (player_id, last) in enumerate(zip(self.player_ids, (self.ends - 1).tolist())):
+            current_record = self.batches[self.batch_index[last]].record(int(self.row_index[last]))
+            yield (player_id, current_record, player_names[code],
+                   MetricDataPoint(maxima["mmr"][code], maxima["power"][code], total_wins=maxima["total_wins"][code]),
+                   MetricDataPoint(minima["mmr"][code], minima["power"][code], total_wins=minima["total_wins"][code]))
+
+    def records(self, player_id):
+        code = self.player_codes[player_id]
+        start, end = int(self.starts[code]), int(self.ends[code])
+        return [self.batches[batch].record(row) for batch, row in
+                zip(self.batch_index[start:end].tolist(), self.row_index[start:end].tolist())]
+
+
+class RecordLoaders:
+    """
+    Loads the records of a player from several sources, like the record store and batches, sorted by time. Saved
+    batches are in the record store as well, a record is identified by its timestamp.
+    """
+    __slots__ = ("loaders",)
+
+    def __init__(self, loaders):
+        self.loaders = loaders
+
+    @classmethod
+    def chain(cls, first, second):
+        if isinstance(first, cls):
+            first.loaders.append(second)
+            return first
+        return cls([first, second])
+
+    def __call__(self, player_id):
+        records = {record.timestamp: record for loader in reversed(self.loaders) for record in loader(player_id)}
+        return sorted(records.values(), key=lambda r: r.timestamp)
+
+
+class RollingStats:
+    """ Metric changes between the records of a player within ROLLING_WINDOW before its latest record """
+    __slots__ = ("intervals", "last_record", "hours", "mmr", "power", "wins")
+
+    def __init__(self):
+        self.intervals = deque()  # (end timestamp, hours, mmr delta, power delta, wins delta) between two records
+        self.last_record = None
+        self.hours = 0.0
+        self.mmr = 0
+        self.power = 0
+        self.wins = 0
+
+    def add(self, records: [PlayerRecord]):
+        """ Adds the changes up to the new records, they must be sorted and newer than the previous ones """
+        for record in records:
+            previous = self.last_record
+            self.last_record = record
+            if previous is None:
+                continue
+            interval = (record.timestamp, (record.timestamp - previous.timestamp).total_seconds() / 3600,
+                        record.metrics.mmr - previous.metrics.mmr, record.metrics.power - previous.metrics.power,
+                        record.metrics.total_wins - previous.metrics.total_wins)
+            self.intervals.append(interval)
+            self.change_totals(interval, 1)
+        if self.last_record is not None:
+            window_start = self.last_record.timestamp - ROLLING_WINDOW
+            while self.intervals and self.intervals[0][0] <= window_start:
+                self.change_totals(self.intervals.popleft(), -1)
+
+    def change_totals(self, interval, sign):
+        _, hours, mmr, power, wins = interval
+        self.hours = self.hours + sign * hours
+        self.mmr = self.mmr + sign * mmr
+        self.power = self.power + sign * power
+        self.wins = self.wins + sign * wins
+
+    def per_hour(self, change):
+        return change / self.hours if self.hours > 0 else 0
+
+    @property
+    def mmr_per_hour(self):
+        return self.per_hour(self.mmr)
+
+    @property
+    def power_per_hour(self):
+        return self.per_hour(self.power)
+
+    @property
+    def wins_per_hour(self):
+        return self.per_hour(self.wins)
+
+    @property
+    def win_rate(self):
+        """ Estimated share of won games, the losses are guessed from the mmr that the wins do not explain """
+        losses = max(self.wins - self.mmr / MMR_PER_GAME, 0)
+        games = self.wins + losses
+        return self.wins / games if games > 0 else None
+
+
 class PlayerStats:
+    __slots__ = ("id", "current_name", "aliases", "_records", "_record_loader", "_aggregated", "_rolling", "_summaries",
+                 "current_metrics", "max_metrics", "min_metrics", "last_timestamp", "score", "score_rank", "color",
+                 "is_top_player")
+
     def __init__(self, start_record: PlayerRecord):
         self.id = start_record.id
         self.current_name = start_record.name
         self.aliases = set()
-        self.records = [start_record]
+        self._records = [start_record]
+        self._record_loader = None
+        self._aggregated = 1  # leading records that are included in the stats, they are sorted by time
+        self._rolling = None  # calculated once needed, then updated with the new records
+        self._summaries = None  # stats of not loaded records that are not included yet, see add_summary
         self.current_metrics = start_record.metrics
         self.max_metrics = start_record.metrics
         self.min_metrics = start_record.metrics
+        self.last_timestamp = start_record.timestamp
         self.score = None
         self.score_rank = None
         self.color = "red"
         self.is_top_player = False
 
+    @classmethod
+    def from_summary(cls, current_record: PlayerRecord, aliases, max_metrics: MetricDataPoint,
+                     min_metrics: MetricDataPoint, record_loader):
+        """ Player with precalculated stats whose records only get loaded by record_loader(id) once needed """
+        player = cls(current_record)
+        player.aliases = aliases
+        player.max_metrics = max_metrics
+        player.min_metrics = min_metrics
+        player._records = None
+        player._record_loader = record_loader
+        return player
+
+    @property
+    def records(self):
+        if self._records is None:
+            self._records = self._record_loader(self.id)
+            self._record_loader = None
+            # records of summaries that are not included yet make the next update recalculate everything
+            self._aggregated = 0 if self._summaries else len(self._records)
+            self._summaries = None
+        return self._records
+
+    @property
+    def rolling_stats(self):
+        """ Metric changes of the recent records, only the ones within ROLLING_WINDOW are read """
+        if self._rolling is None:
+            records = self.records
+            self._rolling = RollingStats()
+            if self._aggregated:
+                end = self._aggregated
+                window_start = records[end - 1].timestamp - ROLLING_WINDOW
+                # the record before the window is the start of the first change within it
+                start = bisect.bisect_right(records, window_start, hi=end, key=lambda r: r.timestamp) - 1
+                self._rolling.add(records[max(start, 0):end])
+        return self._rolling
+
     def update_metrics(self):
+        """ Includes the records added since the last update in the stats, only recalculates all if they are older """
+        if self._records is None:
+            self.include_summaries()  # the stats of not loaded records only change by their summaries
+            return
+        new_records = sorted(self._records[self._aggregated:], key=lambda r: r.timestamp)
+        if not new_records:
+            return
+        if self._aggregated and new_records[0].timestamp >= self.last_timestamp:
+            self._records[self._aggregated:] = new_records
+            self.add_to_metrics(new_records)
+        else:
+            self.calculate_metrics()
+        self._aggregated = len(self._records)
+
+    def add_to_metrics(self, new_records):
+        names = set(self.aliases)
+        names.add(self._records[self._aggregated - 1].name)  # the name up to now, whatever current_name was set to
+        names.update(r.name for r in new_records)
+        self.current_metrics = new_records[-1].metrics
+        self.last_timestamp = new_records[-1].timestamp
+        self.current_name = new_records[-1].name
+        self.aliases = list(names - {self.current_name})
+        if self._rolling is not None:
+            self._rolling.add(new_records)
+
+        self.max_metrics = MetricDataPoint(
+            max(self.max_metrics.mmr, max(r.metrics.mmr for r in new_records)),
+            max(self.max_metrics.power, max(r.metrics.power for r in new_records)),
+            total_wins=max(self.max_metrics.total_wins, max(r.metrics.total_wins for r in new_records))
+        )
+        self.min_metrics = MetricDataPoint(
+            min(self.min_metrics.mmr, min(r.metrics.mmr for r in new_records)),
+            min(self.min_metrics.power, min(r.metrics.power for r in new_records)),
+            total_wins=min(self.min_metrics.total_wins, min(r.metrics.total_wins for r in new_records))
+        )
+
+    def calculate_metrics(self):
         self.records.sort(key=lambda r: r.timestamp)
         self.current_metrics = self.records[-1].metrics
+        self.last_timestamp = self.records[-1].timestamp
+        self.current_name = self.records[-1].name
         self.aliases = list({r.name for r in self.records if r.name != self.current_name})
+        self._rolling = None
 
         mmr_values = [r.metrics.mmr for r in self.records]
         power_values = [r.metrics.power for r in self.records]
@@ -56,16 +360,205 @@ class PlayerStats:
     def add_record(self, record: PlayerRecord):
         self.records.append(record)
 
-    def calculate_score(self, max_metrics: MetricDataPoint, last_timestamp):
-        loss_ratio = math.sqrt(math.sqrt(self.max_metrics.total_wins / (self.max_metrics.power / 600)))
-        mmr_percentage = (self.current_metrics.mmr / max_metrics.mmr)
-        power_percentage = (self.current_metrics.power / max_metrics.power)
-        self.score = mmr_percentage * 9 + power_percentage * 1 - loss_ratio * 0.1
-        if last_timestamp != self.records[-1].timestamp:
-            self.score = self.score - 10  # outside top 200 so should have a negative score
+    def add_summary(self, current_record: PlayerRecord, names, max_metrics: MetricDataPoint,
+                    min_metrics: MetricDataPoint, record_loader):
+        """
+        Adds records that are only known by their stats. Loaded records get the new ones right away, otherwise the
+        records get loaded together later and the stats are taken from the summary. Both are included by the next
+        update.
+        """
+        if self._records is not None:
+            self._records.extend(record_loader(self.id))
+            return
+        self._summaries = (self._summaries or []) + [(current_record, names, max_metrics, min_metrics)]
+        self._record_loader = RecordLoaders.chain(self._record_loader, record_loader)
+
+    def include_summaries(self):
+        for current_record, names, max_metrics, min_metrics in self._summaries or ():
+            names = set(self.aliases) | {self.current_name} | set(names)
+            if current_record.timestamp >= self.last_timestamp:
+                self.current_metrics = current_record.metrics
+                self.last_timestamp = current_record.timestamp
+                self.current_name = current_record.name
+            self.aliases = list(names - {self.current_name})
+            self.max_metrics = MetricDataPoint(
+                max(self.max_metrics.mmr, max_metrics.mmr),
+                max(self.max_metrics.power, max_metrics.power),
+                total_wins=max(self.max_metrics.total_wins, max_metrics.total_wins)
+            )
+            self.min_metrics = MetricDataPoint(
+                min(self.min_metrics.mmr, min_metrics.mmr),
+                min(self.min_metrics.power, min_metrics.power),
+                total_wins=min(self.min_metrics.total_wins, min_metrics.total_wins)
+            )
+        self._summaries = None
+
+    def records_between(self, start, end):
+        """
+        Records from start to end (both included), found by binary search over the records included in the stats.
+        Records added since the last update are not sorted yet and get checked one by one, the stats are only updated
+        by the leaderboard.
+        """
+        records = self.records
+        aggregated = self._aggregated
+        between = records[bisect.bisect_left(records, start, hi=aggregated, key=lambda r: r.timestamp):
+                          bisect.bisect_right(records, end, hi=aggregated, key=lambda r: r.timestamp)]
+        new_records = [record for record in records[aggregated:] if start <= record.timestamp <= end]
+        if new_records:
+            between = sorted(between + new_records, key=lambda r: r.timestamp)
+        return between
+
+    def prune_records(self, kept_timestamps, dropped_timestamps):
+        """ Drops the records of dropped snapshots that do not matter for the stats, returns how many got removed """
+        if self._records is None:
+            return 0  # not loaded records were already pruned by the record store
+        if not any(r.timestamp in dropped_timestamps for r in self._records):
+            return 0
+        record_count = len(self._records)
+        retained = retained_records(self._records, kept_timestamps)
+        if len(retained) == record_count:
+            return 0
+        self._records = retained
+        self._aggregated = 0
+        return record_count - len(retained)
+
+
+@lru_cache(maxsize=4)
+def score_colors(player_count):
+    """ Colors of all score ranks, they only change with the player count """
+    return [calculate_color(1 - float(score_rank) / player_count) for score_rank in range(1, player_count + 1)]
+
 
-    def was_top_player(self, timestamp):
-        return any(r.timestamp == timestamp for r in self.records)
+def calculate_scores(mmr, power, max_mmr, max_power, player_max_power, player_max_total_wins):
+    """ Scores from metric columns, mmr and power are relative to the maxima of all players """
+    loss_ratio = np.sqrt(np.sqrt(player_max_total_wins / (player_max_power / 600)))
+    return mmr / max_mmr * 9 + power / max_power * 1 - loss_ratio * 0.1
+
+
+class ScoreTable:
+    """ The metrics the score depends on for all players as columns, so all scores get calculated in one pass """
+
+    def __init__(self):
+        self.players = []
+        self.rows = {}
+        self.current_mmr = np.zeros(0, dtype=np.int64)
+        self.current_power = np.zeros(0, dtype=np.int64)
+        self.max_power = np.zeros(0, dtype=np.int64)
+        self.max_total_wins = np.zeros(0, dtype=np.int64)
+        self.last_timestamp = np.zeros(0, dtype=np.int64)
+
+    def rebuild(self, players):
+        self.__init__()
+        self.update(players)
+
+    def update(self, players: [PlayerStats]):
+        """ Copies the metrics of new or changed players into the columns """
+        players = list(players)
+        for player in players:
+            if player.id not in self.rows:
+                self.rows[player.id] = len(self.players)
+                self.players.append(player)
+            else:
+                self.players[self.rows[player.id]] = player
+        if len(self.current_mmr) < len(self.players):
+            missing = len(self.players) - len(self.current_mmr)
+            for column in ("current_mmr", "current_power", "max_power", "max_total_wins", "last_timestamp"):
+                setattr(self, column, np.append(getattr(self, column), np.zeros(missing, dtype=np.int64)))
+
+        rows = [self.rows[player.id] for player in players]
+        self.current_mmr[rows] = [player.current_metrics.mmr for player in players]
+        self.current_power[rows] = [player.current_metrics.power for player in players]
+        self.max_power[rows] = [player.max_metrics.power for player in players]
+        self.max_total_wins[rows] = [player.max_metrics.total_wins for player in players]
+        self.last_timestamp[rows] = [to_epoch(player.last_timestamp) for player in players]
+
+    def calculate(self, max_metrics: MetricDataPoint, last_timestamp):
+        """ Sets score, score rank, color and top player state of all players, returns the scores and top players """
+        scores = calculate_scores(self.current_mmr, self.current_power, max_metrics.mmr, max_metrics.power,
+                                  self.max_power, self.max_total_wins)
+        # players that were not in the latest snapshot are outside top 200 so should have a negative score
+        is_top_player = self.last_timestamp == to_epoch(last_timestamp)
+        scores = np.where(is_top_player, scores, scores - 10)
+
+        # stable like sorted(), so equal scores keep the player order
+        ranking = np.argsort(-scores, kind="stable")
+        score_ranks = np.empty(len(scores), dtype=np.int64)
+        score_ranks[ranking] = np.arange(1, len(scores) + 1)
+        colors = score_colors(len(scores))
+
+        for player, score, score_rank, top_player in zip(self.players, scores.tolist(), score_ranks.tolist(),
+                                                         is_top_player.tolist()):
+            player.score = score
+            player.score_rank = score_rank
+            player.color = colors[score_rank - 1]
+            player.is_top_player = top_player
+        return scores, is_top_player
+
+
+class ScoreHistory:
+    """
+    Score and score rank of every player in every snapshot, relative to the best mmr and power of that snapshot.
+    Snapshots newer than the scored ones get added, everything is scored again if an older one shows up. Snapshots are
+    read and scored in chunks and the results are kept as columns, sorted by player within every chunk.
+    """
+
+    def __init__(self):
+        self.timestamps = []
+        self.player_codes = {}  # player id -> number of the player in the columns
+        self.chunks = []  # (player codes, timestamp indices, scores, score ranks)
+
+    def update(self, timestamps, snapshot_columns):
+        """ Scores the snapshots of the sorted timestamps that are not scored yet, see Leaderboard.snapshot_columns """
+        scored = len(self.timestamps)
+        if scored and (len(timestamps) < scored or timestamps[scored - 1] != self.timestamps[-1]):
+            self.__init__()
+            scored = 0
+        for start in range(scored, len(timestamps), SCORE_HISTORY_CHUNK):
+            chunk = timestamps[start:start + SCORE_HISTORY_CHUNK]
+            self.add_snapshots(*snapshot_columns(chunk))
+            self.timestamps.extend(chunk)
+
+    def add_snapshots(self, ids, snapshot_index, mmr, power, total_wins):
+        """ Scores all records of the snapshots in one pass, the records are grouped by snapshot """
+        if not ids:
+            return
+        snapshots, starts = np.unique(snapshot_index, return_index=True)
+        group = np.searchsorted(snapshots, snapshot_index)
+        max_mmr = np.maximum.reduceat(mmr, starts)[group]
+        max_power = np.maximum.reduceat(power, starts)[group]
+        scores = calculate_scores(mmr, power, max_mmr, max_power, power, total_wins)
+        # ranks within each snapshot, stable so equal scores keep the record order
+        ranking = np.lexsort((-scores, group))
+        score_ranks = np.empty(len(scores), dtype=np.int64)
+        score_ranks[ranking] = np.arange(len(scores)) - starts[group[ranking]] + 1
+
+        codes = np.array([self.player_code(player_id) for player_id in ids], dtype=np.int64)
+        columns = (codes, snapshot_index + len(self.timestamps), scores, score_ranks)
+        # the few snapshots of live updates go into the last chunk, so a lookup only has to search a few chunks
+        if self.chunks and len(self.chunks[-1][0]) < SCORE_HISTORY_CHUNK_ROWS:
+            columns = tuple(np.concatenate(pair) for pair in zip(self.chunks.pop(), columns))
+        # stable, so the rows of a player stay ordered by time
+        order = np.argsort(columns[0], kind="stable")
+        self.chunks.append(tuple(column[order] for column in columns))
+
+    def player_code(self, player_id):
+        code = self.player_codes.get(player_id)
+        if code is None:
+            code = self.player_codes[player_id] = len(self.player_codes)
+        return code
+
+    def player(self, player_id):
+        """ Timestamps, scores and score ranks of the player """
+        timestamps, scores, score_ranks = [], [], []
+        code = self.player_codes.get(player_id)
+        if code is None:
+            return timestamps, scores, score_ranks
+        for codes, indices, chunk_scores, chunk_ranks in self.chunks:
+            start, end = np.searchsorted(codes, [code, code + 1])
+            timestamps.extend(self.timestamps[index] for index in indices[start:end].tolist())
+            scores.extend(chunk_scores[start:end].tolist())
+            score_ranks.extend(chunk_ranks[start:end].tolist())
+        return timestamps, scores, score_ranks
 
 
 class Leaderboard:
@@ -77,52 +570,353 @@ class Leaderboard:
         self.min_score = 0
         self.last_timestamp = None
         self.timestamps = []
+        self.snapshot_timestamps = set()
+        self.unsaved_records = []
+        self.unsaved_batches = []
+        # batches whose rows are not summed up per player yet, that happens with the next metrics update
+        self.batches = []
+        # players with records that are not included in the metrics yet, everything gets recalculated on a full update
+        self.dirty_players = set()
+        self.new_timestamps = []
+        self.full_update = True
+        self.score_table = ScoreTable()
+        self.score_history = ScoreHistory()
+        self.snapshot_diffs = SnapshotDiffs()
+        # records of every snapshot, snapshots of not loaded records are loaded by snapshot_loader(timestamp)
+        self.snapshot_records = {}
+        self.snapshot_batches = {}  # snapshots that are only kept as batch
+        self.snapshot_loader = None
+        # metric columns of not loaded records from start to end by snapshot_columns_loader(start, end), if supported
+        self.snapshot_columns_loader = None
+        self._snapshot_members = {}
+        # increases with every metrics update, the ordered player views stay valid until then
+        self.version = 0
+        self._player_views = {}
+        self._player_views_version = 0
+        # names and aliases of all players, new names get added once the metrics of their players are updated
+        self.name_index = NameIndex()
 
     def add_record(self, record: PlayerRecord):
         if record.id in self.players:
             self.players[record.id].add_record(record)
         else:
             self.players[record.id] = PlayerStats(record)
+        self.add_to_snapshot(record)
+        self.unsaved_records.append(record)
+        self.dirty_players.add(record.id)
+        self.name_index.add(record.id, record.name)
+
+    def add_timestamp(self, timestamp):
+        """ Returns the records of the snapshot or None if they are only known to the record store """
+        if timestamp not in self.snapshot_timestamps:
+            self.snapshot_timestamps.add(timestamp)
+            self.new_timestamps.append(timestamp)
+            self.snapshot_records[timestamp] = []
+        elif timestamp in self.snapshot_batches:
+            # records join the snapshot of a batch, it is kept as records from now on
+            self.snapshot_records[timestamp] = self.snapshot_batches.pop(timestamp).records()
+        return self.snapshot_records.get(timestamp)
+
+    def add_to_snapshot(self, record: PlayerRecord):
+        snapshot = self.add_timestamp(record.timestamp)
+        if snapshot is not None:
+            snapshot.append(record)
+
+    def add_records(self, records: [PlayerRecord]):
+        """ Adds new records of one known player at once """
+        self.players[records[0].id].records.extend(records)
+        for record in records:
+            self.add_to_snapshot(record)
+        self.unsaved_records.extend(records)
+        self.dirty_players.add(records[0].id)
+
+    def add_player(self, player: PlayerStats):
+        self.players[player.id] = player
+        for record in player.records:
+            self.add_to_snapshot(record)
+        self.unsaved_records.extend(player.records)
+        self.dirty_players.add(player.id)
+
+    def mark_saved(self):
+        self.unsaved_records = []
+        self.unsaved_batches = []
+
+    def take_unsaved(self):
+        """ Returns the records and batches added since the last save, they count as saved from now on """
+        records, batches = self.unsaved_records, self.unsaved_batches
+        self.unsaved_records, self.unsaved_batches = [], []
+        return records, batches
+
+    def add_batch(self, batch: SnapshotBatch):
+        """
+        Adds all rows of a snapshot at once. The batch is kept as the snapshot and its rows only get summed up per
+        player by the next metrics update, see fold_batches. Rows of a known snapshot are added as records.
+        """
+        if not len(batch):
+            return
+        batch.intern_strings()
+        if batch.timestamp in self.snapshot_timestamps:
+            for record in batch.records():
+                self.add_record(record)
+            return
+        self.snapshot_timestamps.add(batch.timestamp)
+        self.new_timestamps.append(batch.timestamp)
+        self.snapshot_batches[batch.timestamp] = batch
+        self.batches.append(batch)
+        self.unsaved_batches.append(batch)
+
+    def fold_batches(self):
+        """
+        Sums up the rows of the added batches per player. New players and players whose records are not loaded only
+        get their stats, records are created from the rows once needed. Returns the ids of the known players that show
+        up with a newer name.
+        """
+        renamed = set()
+        if not self.batches:
+            return renamed
+        rows = BatchRows(self.batches)
+        self.batches = []
+        for player_id, current_record, names, max_metrics, min_metrics in rows.summaries():
+            player = self.players.get(player_id)
+            if player is None:
+                self.players[player_id] = PlayerStats.from_summary(
+                    current_record, [name for name in names if name != current_record.name], max_metrics,
+                    min_metrics, rows.records)
+                continue
+            if current_record.timestamp > player.last_timestamp and current_record.name != player.current_name:
+                renamed.add(player_id)
+            player.add_summary(current_record, names, max_metrics, min_metrics, rows.records)
+        self.dirty_players.update(rows.player_ids)
+        return renamed
+
+    def prune_snapshots(self, kept_timestamps):
+        """
+        Removes all snapshots except the kept ones, returns how many records got removed.
+        The few records that are kept for the player stats do not count as snapshot anymore.
+        """
+        kept_timestamps = set(kept_timestamps)
+        dropped_timestamps = self.snapshot_timestamps - kept_timestamps
+        if not dropped_timestamps:
+            return 0
+        self.fold_batches()
+        for timestamp in dropped_timestamps & self.snapshot_batches.keys():
+            for player_id in self.snapshot_batches.pop(timestamp).ids:
+                self.players[player_id].records  # rows of batches are only pruned once they are records
+        removed = 0
+        pruned_players = set()
+        for player in self.players.values():
+            player_removed = player.prune_records(kept_timestamps, dropped_timestamps)
+            if player_removed:
+                removed = removed + player_removed
+                pruned_players.add(player.id)
+        # the stats of pruned players stay the same, they only need to sort and aggregate their records again
+        self.dirty_players.update(pruned_players)
+        remaining = {(record.id, record.timestamp) for player_id in pruned_players
+                     for record in self.players[player_id].records}
+        # unsaved batches of dropped snapshots only get the rows saved that were kept
+        for batch in [batch for batch in self.unsaved_batches if batch.timestamp in dropped_timestamps]:
+            self.unsaved_batches.remove(batch)
+            self.unsaved_records.extend(batch.records())
+        self.unsaved_records = [record for record in self.unsaved_records
+                                if record.id not in pruned_players or (record.id, record.timestamp) in remaining]
+        self.snapshot_timestamps = self.snapshot_timestamps & kept_timestamps
+        self.snapshot_records = {timestamp: records for timestamp, records in self.snapshot_records.items()
+                                 if timestamp in self.snapshot_timestamps}
+        self._snapshot_members = {}
+        self.score_history = ScoreHistory()
+        return removed
+
+    def known_timestamps(self):
+        return set(self.snapshot_timestamps)
+
+    def snapshot(self, timestamp, keep=True):
+        """ Records of all players in the snapshot at exactly the timestamp, loaded ones are kept if keep is set """
+        records = self.snapshot_records.get(timestamp)
+        if records is None:
+            if timestamp in self.snapshot_batches:
+                return self.snapshot_batches[timestamp].records()
+            if self.snapshot_loader is None or timestamp not in self.snapshot_timestamps:
+                return []
+            records = self.snapshot_loader(timestamp)
+            if keep:
+                self.snapshot_records[timestamp] = records
+        return records
+
+    def snapshot_at(self, timestamp):
+        """ Records of the latest snapshot at or before the timestamp ordered by world rank, empty if there is none """
+        self.update_timestamps()
+        index = bisect.bisect_right(self.timestamps, timestamp)
+        if index == 0:
+            return []
+        return sorted(self.snapshot(self.timestamps[index - 1]), key=lambda r: r.metrics.world_rank)
+
+    def snapshot_members(self, timestamp):
+        """ Ids of all players in the snapshot, the sets of recently asked snapshots are kept """
+        records = self.snapshot(timestamp)
+        count, members = self._snapshot_members.get(timestamp, (None, None))
+        if count != len(records):
+            if len(self._snapshot_members) >= SNAPSHOT_MEMBER_CACHE_SIZE:
+                self._snapshot_members.pop(next(iter(self._snapshot_members)))
+            members = {record.id for record in records}
+            self._snapshot_members[timestamp] = (len(records), members)
+        return members
+
+    def diff_snapshot(self, timestamp):
+        """ Changes of the snapshot compared to the one before it, the diff is added to the snapshot diff history """
+        self.update_timestamps()
+        index = bisect.bisect_left(self.timestamps, timestamp)
+        previous = self.timestamps[index - 1] if index > 0 else None
+        if self.snapshot_diffs.timestamp != previous:
+            # the diffs were not following the snapshots, start from the previous one
+            self.snapshot_diffs.reset(previous, self.snapshot(previous) if previous is not None else [])
+        return self.snapshot_diffs.add(timestamp, self.snapshot(timestamp))
+
+    def snapshot_columns(self, timestamps):
+        """
+        Player ids, snapshot index (into the sorted timestamps), mmr, power and total wins of all records of the
+        snapshots, grouped by snapshot. Snapshots of the record store are read in one pass over their time range if it
+        supports that. Nothing read from the record store is kept.
+        """
+        ids, indices, metrics = [], [], []
+        batches, stored = [], []
+        for index, timestamp in enumerate(timestamps):
+            if timestamp in self.snapshot_batches:
+                batches.append((index, self.snapshot_batches[timestamp]))
+            elif timestamp in self.snapshot_records or self.snapshot_columns_loader is None:
+                records = self.snapshot(timestamp, keep=False)
+                ids.extend(record.id for record in records)
+                indices.extend([index] * len(records))
+                metrics.extend((r.metrics.mmr, r.metrics.power, r.metrics.total_wins) for r in records)
+            elif timestamp in self.snapshot_timestamps:
+                stored.append(index)
+        metrics = np.array(metrics, dtype=np.int64).reshape(-1, len(METRICS))
+        indices = np.array(indices, dtype=np.int64)
+        columns = [metrics[:, column] for column in range(len(METRICS))]
+
+        if batches:
+            for _, batch in batches:
+                ids.extend(batch.ids)
+            indices = np.concatenate([indices] + [np.full(len(batch), index) for index, batch in batches])
+            columns = [np.concatenate([column] + [getattr(batch, metric) for _, batch in batches]).astype(np.int64)
+                       for column, metric in zip(columns, METRICS)]
+
+        if stored:
+            stored = np.array(stored, dtype=np.int64)
+            epochs = np.array([to_epoch(timestamps[index]) for index in stored.tolist()], dtype=np.int64)
+            store_ids, store_epochs, *store_columns = self.snapshot_columns_loader(timestamps[stored[0]],
+                                                                                  timestamps[stored[-1]])
+            # the time range also holds records of other snapshots, like the ones kept of dropped snapshots
+            positions = np.minimum(np.searchsorted(epochs, store_epochs), len(epochs) - 1)
+            wanted = np.flatnonzero(epochs[positions] == store_epochs)
+            ids.extend(store_ids[row] for row in wanted.tolist())
+            indices = np.concatenate([indices, stored[positions[wanted]]])
+            columns = [np.concatenate([column, store_column[wanted]])
+                       for column, store_column in zip(columns, store_columns)]
+
+        order = np.argsort(indices, kind="stable")
+        return [ids[row] for row in order.tolist()], indices[order], *(column[order] for column in columns)
+
+    def player_score_history(self, player_id):
+        """ Timestamps, scores and score ranks of the player in every snapshot it was in """
+        self.update_timestamps()
+        self.score_history.update(self.timestamps, self.snapshot_columns)
+        return self.score_history.player(player_id)
+
+    def was_top_player(self, player: PlayerStats, timestamp=None):
+        """ Whether the player was in the snapshot at timestamp (default the latest one) """
+        timestamp = timestamp or self.last_timestamp
+        if timestamp is None:
+            return False
+        if timestamp >= player.last_timestamp:
+            return timestamp == player.last_timestamp
+        return player.id in self.snapshot_members(timestamp)
 
     def get_player(self, player_id):
         return self.players.get(player_id, None)
 
-    def get_players(self):
-        if any(player.score is None for player in self.players.values()):
+    def get_players(self, order_by="score_rank"):
+        """
+        All players ordered by score rank, mmr, power, wins or world rank. The list is shared by all callers until the
+        data changes, so it must not be modified.
+        """
+        if self.needs_update():
             self.update_metrics()
-        return sorted(self.players.values(), key=lambda p: p.score_rank)
+        if self._player_views_version != self.version:
+            self._player_views = {}
+            self._player_views_version = self.version
+        players = self._player_views.get(order_by)
+        if players is None:
+            key, descending = PLAYER_ORDERS[order_by]
+            players = self._player_views[order_by] = sorted(self.players.values(), key=key, reverse=descending)
+        return players
 
-    def update_metrics(self):
-        for player in self.players.values():
+    def find_players(self, text):
+        """ Players with a name or alias that contains the text (case and width insensitive) ordered by score rank """
+        if self.needs_update():
+            self.update_metrics()
+        return sorted((self.players[player_id] for player_id in self.name_index.search(text)),
+                      key=lambda p: p.score_rank)
+
+    def needs_update(self):
+        return bool(self.batches) or bool(self.players) and (self.full_update or bool(self.dirty_players))
+
+    def update_metrics(self, player_ids=None):
+        """
+        Recalculates the metrics. Only the players with new records since the last update (and the given ones) refresh
+        their stats, the global stats get updated from them. Scores and ranks depend on all players and are always
+        recalculated.
+        """
+        self.fold_batches()
+        if self.full_update:
+            dirty = list(self.players.values())
+        else:
+            dirty = [self.players[i] for i in self.dirty_players.union(player_ids or ())]
+        previous_max_metrics = {player.id: player.max_metrics for player in dirty}
+        for player in dirty:
             player.update_metrics()
-        self.last_timestamp = max(max(r.timestamp for r in p.records) for p in self.players.values())
-        self.timestamps = sorted(set(
-            record.timestamp for player in self.players.values() for record in player.records
-        ))  # Unique sorted timestamps
-        self.max_metrics = MetricDataPoint(
-            max(p.max_metrics.mmr for p in self.players.values()),
-            max(p.max_metrics.power for p in self.players.values()),
-            world_rank=1,
-            total_wins=max(p.max_metrics.total_wins for p in self.players.values())
-        )
-        self.min_metrics = MetricDataPoint(
-            min(p.max_metrics.mmr for p in self.players.values()),
-            min(p.max_metrics.power for p in self.players.values()),
-            world_rank=200,
-            total_wins=min(p.max_metrics.total_wins for p in self.players.values())
-        )
+            self.name_index.add_player(player)
+        self.update_timestamps()
 
-        for player in self.players.values():
-            player.calculate_score(self.max_metrics, self.last_timestamp)
-            player.is_top_player = player.was_top_player(self.last_timestamp)
+        if self.full_update:
+            self.last_timestamp = max(p.last_timestamp for p in self.players.values())
+            maxima = {m: max(getattr(p.max_metrics, m) for p in self.players.values()) for m in METRICS}
+            minima = {m: min(getattr(p.max_metrics, m) for p in self.players.values()) for m in METRICS}
+        else:
+            self.last_timestamp = max([self.last_timestamp] + [p.last_timestamp for p in dirty])
+            maxima = {m: max([getattr(self.max_metrics, m)] + [getattr(p.max_metrics, m) for p in dirty])
+                      for m in METRICS}
+            minima = {m: self.running_minimum(m, dirty, previous_max_metrics) for m in METRICS}
+        self.max_metrics = MetricDataPoint(maxima["mmr"], maxima["power"], world_rank=1,
+                                           total_wins=maxima["total_wins"])
+        self.min_metrics = MetricDataPoint(minima["mmr"], minima["power"], world_rank=200,
+                                           total_wins=minima["total_wins"])
+        if self.full_update:
+            self.score_table.rebuild(self.players.values())
+        else:
+            self.score_table.update(dirty)
+        self.dirty_players = set()
+        self.full_update = False
+        self.version = self.version + 1
 
-        sorted_players = sorted(self.players.values(), key=lambda p: p.score, reverse=True)
+        scores, is_top_player = self.score_table.calculate(self.max_metrics, self.last_timestamp)
+        self.max_score = float(scores.max())
+        self.min_score = float(scores[is_top_player].min())
 
-        for score_rank, player in enumerate(sorted_players, start=1):
-            player.score_rank = score_rank
-            player.color = calculate_color(1 - float(score_rank) / len(sorted_players))
+    def running_minimum(self, metric, dirty, previous_max_metrics):
+        """ Minimum of the player maxima, they only grow so all players are only checked if the minimal one grew """
+        minimum = getattr(self.min_metrics, metric)
+        if any(getattr(previous_max_metrics[p.id], metric) == minimum != getattr(p.max_metrics, metric) for p in dirty):
+            return min(getattr(p.max_metrics, metric) for p in self.players.values())
+        return min([minimum] + [getattr(p.max_metrics, metric) for p in dirty])
 
-        self.max_score = max(p.score for p in self.players.values()),
-        self.min_score = min(
-            p.score for p in self.players.values() if p.was_top_player(self.last_timestamp)
-        )
+    def update_timestamps(self):
+        """ Inserts the new snapshot timestamps into the sorted timestamps """
+        new_timestamps = sorted(self.new_timestamps)
+        self.new_timestamps = []
+        if self.full_update or len(self.timestamps) + len(new_timestamps) != len(self.snapshot_timestamps):
+            self.timestamps = sorted(self.snapshot_timestamps)  # Unique sorted timestamps
+        elif new_timestamps and self.timestamps and new_timestamps[0] < self.timestamps[-1]:
+            for timestamp in new_timestamps:
+                bisect.insort(self.timestamps, timestamp)
+        else:
+            self.timestamps.extend(new_timestamps)
@@ -1,39 +1,137 @@
 from app.configuration import settings
-from app.leaderboard.log_importer import extract_leaderboard_data
+from app.leaderboard.leaderboard import Leaderboard, PlayerStats
+from app.leaderboard.log_importer import extract_leaderboard_data, import_snapshot
+from app.leaderboard.retention import prune_leaderboard
 
 
-def load_leaderboard():
+def load_saved_leaderboard():
     print("Loading existing leaderboard data...")
     leaderboard = settings.load_leaderboard()
+    if leaderboard.players:
+        print("Calculate metrics...")
+        leaderboard.update_metrics()
+    return leaderboard
+
+
+def import_new_records(leaderboard, log_folder, on_error=None):
+    """ Imports the log records the leaderboard does not know yet, returns them together with the new checkpoints """
+    # checkpoints are only valid as long as the records they point to got saved
+    checkpoints = settings.load_log_checkpoints() if leaderboard.players else {}
     print("Importing new records from logs...")
-    new_leaderboard = extract_leaderboard_data(settings.game_log_filepath())
+    new_leaderboard = extract_leaderboard_data(log_folder, checkpoints,
+                                               workers=settings.get_settings().import_workers,
+                                               known_timestamps=leaderboard.known_timestamps(),
+                                               on_error=on_error)
+    return new_leaderboard, checkpoints
 
+
+def apply_imported_records(leaderboard, new_leaderboard):
     print("Merging data...")
-    merge_leaderboards(new_leaderboard, leaderboard)
+    stats = merge_leaderboards(new_leaderboard, leaderboard)
+    retention = settings.retention_policy()
+    if (stats.new_records or stats.new_players) and retention is not None:
+        prune_leaderboard(leaderboard, retention)
+
+    if leaderboard.players:
+        print("Calculate metrics...")
+        leaderboard.update_metrics(player_ids=new_leaderboard.players.keys())
+        print(f"Leaderboard latest record is: {leaderboard.last_timestamp}")
+
+
+def write_records(records, batches=()):
+    """
+    Saves new records and snapshot batches, this has to succeed before the checkpoints that point behind them get
+    saved
+    """
+    if records or batches:
+        print(f"Saving {len(records) + sum(len(batch) for batch in batches)} new records...")
+        settings.save_records(records, batches)
+
+
+def write_checkpoints(checkpoints):
+    settings.save_log_checkpoints(checkpoints)
 
-    print("Calculate metrics...")
-    leaderboard.update_metrics()
+
+def import_snapshots(leaderboard, snapshots):
+    """ Adds live snapshot batches to the leaderboard and only refreshes the players in them """
+    new_leaderboard = Leaderboard()
+    for batch in snapshots:
+        import_snapshot(batch, new_leaderboard)
+    if not new_leaderboard.snapshot_timestamps:
+        return False
+
+    known_timestamps = leaderboard.known_timestamps()
+    merge_leaderboards(new_leaderboard, leaderboard)
+    for timestamp in sorted(new_leaderboard.snapshot_timestamps - known_timestamps):
+        print(leaderboard.diff_snapshot(timestamp).summary())
+    leaderboard.update_metrics(player_ids=new_leaderboard.players.keys())
     print(f"Leaderboard latest record is: {leaderboard.last_timestamp}")
+    return True
 
-    print("Saving updated leaderboard...")
-    settings.save_leaderboard(leaderboard)
 
-    return leaderboard
+class MergeStats:
+    def __init__(self):
+        self.new_players = 0
+        self.new_records = 0
+        self.duplicate_records = 0
+        self.renamed_players = 0
 
 
 def merge_leaderboards(source, target):
-    new_players = 0
-    new_records = 0
-    for player_id, source_player in source.players.items():
-        if player_id in target.players:
-            for source_record in source_player.records:
-                if not any(target_record.timestamp == source_record.timestamp for target_record in
-                           target.players[player_id].records):
-                    target.players[player_id].add_record(source_record)
-                    new_records = new_records + 1
-        else:
-            target.players[player_id] = source_player
-            new_players = new_players + 1
-
-    print(f"Discovered {new_records} new records!")
-    print(f"Discovered {new_players} new players!")
+    """
+    Adds the source records the target does not have yet, a record is identified by player id and timestamp.
+    Batches of snapshots the target does not know are added as they are, without creating records of their rows.
+    """
+    stats = MergeStats()
+    target_players = set(target.players)
+    known_players = set(target_players)
+    batch_records = {}
+    for batch in source.batches:
+        if batch.timestamp in target.snapshot_timestamps:
+            for record in batch.records():
+                batch_records.setdefault(record.id, []).append(record)
+            continue
+        target.add_batch(batch)
+        # like for records, the rows of new players only count as new player
+        stats.new_records = stats.new_records + sum(player_id in target_players for player_id in batch.ids)
+        stats.new_players = stats.new_players + len(set(batch.ids) - known_players)
+        known_players.update(batch.ids)
+    # the batch rows get summed up per player here, that tells which players got renamed
+    stats.renamed_players = len(target.fold_batches())
+    merge_records(batch_records, target, stats)
+    merge_records({player_id: player.records for player_id, player in source.players.items()}, target, stats)
+
+    print(f"Discovered {stats.new_records} new records!")
+    print(f"Discovered {stats.new_players} new players!")
+    if stats.renamed_players:
+        print(f"{stats.renamed_players} players changed their name")
+    return stats
+
+
+def merge_records(source_records, target, stats):
+    """ Adds the records (player id -> records) the target does not have yet """
+    for player_id, records in source_records.items():
+        target_player = target.get_player(player_id)
+        if target_player is None:
+            player = PlayerStats(records[0])
+            player.records.extend(records[1:])
+            target.add_player(player)
+            stats.new_players = stats.new_players + 1
+            continue
+
+        known_timestamps = {record.timestamp for record in target_player.records}
+        new_records = []
+        for record in records:
+            if record.timestamp not in known_timestamps:
+                known_timestamps.add(record.timestamp)
+                new_records.append(record)
+        stats.duplicate_records = stats.duplicate_records + len(records) - len(new_records)
+        if not new_records:
+            continue
+
+        latest = max(new_records, key=lambda r: r.timestamp)
+        # the name itself changes with the metrics update, the previous one becomes an alias then
+        if latest.timestamp > target_player.last_timestamp and latest.name != target_player.current_name:
+            stats.renamed_players = stats.renamed_players + 1
+        target.add_records(new_records)
+        stats.new_records = stats.new_records + len(new_records)
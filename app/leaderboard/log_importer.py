@@ -1,72 +1,228 @@
+import hashlib
 import os
 import re
 import json
+import mmap
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 from app import statics
-from app.leaderboard.leaderboard import Leaderboard, PlayerRecord, MetricDataPoint
+from app.leaderboard.leaderboard import Leaderboard, SnapshotBatch
 
+FINGERPRINT_SIZE = 1024
+SNAPSHOT_MARKER = b"[ResponseRankList]"
+SNAPSHOT_PATTERN = re.compile(
+    rb"\[Info]\[(\d{2}:\d{2}:\d{2}) (\d{4}/\d{2}/\d{2}).*] recv message \[\d+] - \[ResponseRankList]")
+LOG_LINE_PATTERN = re.compile(rb"\[\w+]\[")
+JSON_TOKEN_PATTERN = re.compile(rb'\\.|["\[\]{}]')
+INCOMPLETE = object()
 
-def extract_leaderboard_data(log_folder):
+
+class KnownSnapshots:
+    """ Timestamps and payload hashes of snapshots that do not need to be decoded again """
+
+    def __init__(self, timestamps=()):
+        self.timestamps = set(timestamps)
+        self.digests = set()
+        self.skipped = 0
+
+    def is_new(self, timestamp, data):
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        if timestamp in self.timestamps or digest in self.digests:
+            self.skipped = self.skipped + 1
+            return False
+        self.digests.add(digest)
+        return True
+
+
+def extract_leaderboard_data(log_folder, checkpoints=None, workers=1, known_timestamps=(), on_error=None):
+    """
+    Imports all leaderboard snapshots from the game logs. If checkpoints are given (filename -> checkpoint)
+    only the bytes appended since the last import are parsed and the checkpoints are updated in place.
+    With more than one worker the log files are parsed in a process pool, the result stays the same.
+    Snapshots with known timestamps and repeated snapshots are skipped without decoding them.
+    Import errors are reported to on_error (shown as error dialog by default).
+    """
     leaderboard = Leaderboard()
-    pattern = re.compile(
-        r"\[Info]\[(\d{2}:\d{2}:\d{2}) (\d{4}/\d{2}/\d{2}).*] recv message \[\d+] - \[ResponseRankList]")
+    checkpoints = checkpoints if checkpoints is not None else {}
+
+    log_files = [filename for filename in os.listdir(log_folder) if filename.endswith(".txt")]
+    paths = [os.path.join(log_folder, filename) for filename in log_files]
+    file_checkpoints = [checkpoints.get(filename) for filename in log_files]
+    changed_files = sum(has_new_data(path, checkpoint) for path, checkpoint in zip(paths, file_checkpoints))
+    known = KnownSnapshots(known_timestamps)
 
-    for filename in os.listdir(log_folder):
-        if filename.endswith(".txt"):
-            with open(os.path.join(log_folder, filename), "r", encoding="utf-8") as file:
-                lines = file.readlines()
-                process_log(lines, leaderboard, pattern)
+    if workers > 1 and changed_files > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, changed_files)) as executor:
+            # map keeps the file order, so records get added exactly like in a serial import
+            results = list(executor.map(read_log_file, paths, file_checkpoints, [known] * len(paths)))
+    else:
+        results = map(read_log_file, paths, file_checkpoints, [known] * len(paths))
 
+    skipped = 0
+    imported = set()
+    for filename, (snapshots, checkpoint, file_skipped) in zip(log_files, results):
+        skipped = skipped + file_skipped
+        for batch in snapshots:
+            # repeats across files are only visible here when the files got parsed by different workers
+            if batch is not None and batch.content_digest() in imported:
+                skipped = skipped + 1
+                continue
+            if batch is not None:
+                imported.add(batch.content_digest())
+            import_snapshot(batch, leaderboard, on_error)
+        checkpoints[filename] = checkpoint
+
+    # forget about deleted log files
+    for filename in set(checkpoints) - set(log_files):
+        del checkpoints[filename]
+
+    print(f"Skipped {skipped} already known snapshots!")
     return leaderboard
 
 
-def process_log(lines, leaderboard, pattern):
-    for i, line in enumerate(lines):
-        match = pattern.match(line.strip())
+def read_log_file(path, checkpoint=None, known=None):
+    """
+    Parses everything after the checkpoint of a log file into columnar snapshot batches (None for invalid ones).
+    Returns the snapshots, the new checkpoint and how many known snapshots got skipped.
+    Runs in import worker processes, so it must not touch the ui.
+    """
+    snapshots = []
+    if not has_new_data(path, checkpoint):
+        return snapshots, checkpoint, 0
+
+    known = known if known is not None else KnownSnapshots()
+    skipped = known.skipped
+    offset = resume_offset(path, checkpoint)
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as log:
+        log.seek(offset)
+        for timestamp, payload in iter_snapshots(log, known):
+            batch = snapshot_batch(payload, timestamp)
+            if batch is None or len(batch):
+                snapshots.append(batch)
+        offset = log.tell()
+    return snapshots, {"offset": offset, "fingerprint": fingerprint(path, offset)}, known.skipped - skipped
+
+
+def has_new_data(path, checkpoint):
+    return resume_offset(path, checkpoint) != os.path.getsize(path)
+
+
+def resume_offset(path, checkpoint):
+    """ Returns the byte offset to continue reading from or 0 if the file changed since the checkpoint """
+    if not checkpoint:
+        return 0
+    offset = checkpoint.get("offset", 0)
+    if os.path.getsize(path) < offset or fingerprint(path, offset) != checkpoint.get("fingerprint"):
+        return 0  # log file was replaced or truncated
+    return offset
+
+
+def fingerprint(path, offset):
+    # the already consumed head of a log file never changes as the game only appends to it
+    with open(path, "rb") as file:
+        return hashlib.sha1(file.read(min(offset, FINGERPRINT_SIZE))).hexdigest()
+
+
+def iter_snapshots(log, known=None):
+    """
+    Walks a memory mapped log file once and yields (timestamp, payload) for every leaderboard snapshot.
+    Snapshot lines are located with a raw byte search, so the chatter in between never gets decoded or matched.
+    Payloads already in known are skipped before decoding them.
+    Stops in front of anything that is still being written, so log.tell() is always a safe position to resume from.
+    """
+    while True:
+        marker = log.find(SNAPSHOT_MARKER, log.tell())
+        if marker == -1:
+            # skip to the last complete line, a partial one might still become a snapshot line
+            log.seek(log.rfind(b"\n", log.tell()) + 1 or log.tell())
+            return
+        line_start = log.rfind(b"\n", log.tell(), marker) + 1 or log.tell()
+        log.seek(line_start)
+        line = log.readline()
+        if not line.endswith(b"\n"):
+            log.seek(line_start)  # line is still being written
+            return
+        match = SNAPSHOT_PATTERN.match(line.strip())
         if match:
             time_part, date_part = match.groups()
-            timestamp = datetime.strptime(f"{date_part} {time_part}", "%Y/%m/%d %H:%M:%S")
-            json_data = extract_json_data(lines[i + 1:])
-            if json_data:
-                if "players" not in json_data or len(json_data["players"]) != 200:
-                    statics.show_error("Failed parsing log leaderboard json!\nDid not have expected 200 players")
-                else:
-                    update_leaderboard(json_data, leaderboard, timestamp)
+            timestamp = datetime.strptime(f"{date_part.decode()} {time_part.decode()}", "%Y/%m/%d %H:%M:%S")
+            data = read_json_payload(log)
+            if data is INCOMPLETE:
+                log.seek(line_start)
+                return
+            if data is not None and (known is None or known.is_new(timestamp, data)):
+                payload = decode_payload(data)
+                if payload is not None:
+                    yield timestamp, payload
 
 
-def extract_json_data(json_lines):
+def read_json_payload(log):
+    """
+    Finds the end of the json following a snapshot line by tracking bracket depth and string state and returns its
+    raw bytes. Returns None if there is no payload and INCOMPLETE if the file ends before the payload does.
+    """
     data = []
-    for line in json_lines:
-        data.append(line.strip())
-        try:
-            return json.loads("".join(data))[0]
-        except json.JSONDecodeError:
+    depth = 0
+    in_string = False
+    while True:
+        line_start = log.tell()
+        line = log.readline()
+        if not line.endswith(b"\n"):
+            return INCOMPLETE
+        line = line.strip()
+        if not line:
             continue
-    return None
+        if not data and not line.startswith((b"[", b"{")) or LOG_LINE_PATTERN.match(line):
+            log.seek(line_start)  # not a payload, the line might be the next snapshot
+            return None
+        for token in JSON_TOKEN_PATTERN.finditer(line):
+            char = token.group()
+            if in_string:
+                in_string = char != b'"'
+            elif char == b'"':
+                in_string = True
+            elif char in (b"[", b"{"):
+                depth += 1
+            elif char in (b"]", b"}"):
+                depth -= 1
+                if depth == 0:
+                    data.append(line[:token.end()])
+                    return b"".join(data)
+        data.append(line)
 
 
-def update_leaderboard(leaderboard_json, leaderboard, timestamp):
-    if isinstance(leaderboard_json, dict) and "players" in leaderboard_json:
-        if leaderboard_json.get("type", 1) != 2:
-            return
+def decode_payload(data):
+    try:
+        payload = json.loads(data)
+    except json.JSONDecodeError:
+        return None
+    return payload[0] if isinstance(payload, list) and payload else None
+
 
-        for player in leaderboard_json.get("players", []):
-            update_player(player, leaderboard, timestamp)
+def import_snapshot(batch, leaderboard, on_error=None):
+    if batch is None:
+        (on_error or statics.show_error)("Failed parsing log leaderboard json!\nDid not have expected 200 players")
+    else:
+        leaderboard.add_batch(batch)
 
 
-def update_player(player, leaderboard, timestamp):
+def snapshot_batch(leaderboard_json, timestamp):
+    """ Decodes a snapshot into one columnar batch, it is empty for other leaderboard types or None if invalid """
+    if "players" not in leaderboard_json or len(leaderboard_json["players"]) != 200:
+        return None
+    if leaderboard_json.get("type", 1) != 2:
+        return SnapshotBatch(timestamp, [], [], [], [], [], [])
+    user_ids, names, ranks, points, powers, total_wins = zip(*map(player_row, leaderboard_json["players"]))
+    return SnapshotBatch(timestamp, list(user_ids), list(names), mmr=points, power=powers, world_rank=ranks,
+                         total_wins=total_wins)
+
+
+def player_row(player):
     user_id = player["baseInfo"]["userid"]
     name = player["baseInfo"]["riskInfo"].get("name", "Unknown")
     rank = player.get("rank", 0)
     points = player.get("point", 0)
     power = player["fightPoint"].get("highestPoint", 0)
     total_wins = player["fightPoint"].get("totalWins", 0)
-
-    record = PlayerRecord(
-        id=user_id,
-        timestamp=timestamp,
-        metrics=MetricDataPoint(mmr=points, power=power, world_rank=rank, total_wins=total_wins),
-        name=name
-    )
-    leaderboard.add_record(record)
+    return user_id, name, rank, points, power, total_wins
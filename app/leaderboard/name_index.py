@@ -0,0 +1,79 @@
+import math
+import unicodedata
+from collections import defaultdict
+
+GRAM_SIZE = 3
+
+
+def normalise_name(name):
+    """ Case folded and width normalised, so full width or upper case spellings of a name match as well """
+    return unicodedata.normalize("NFKC", name).casefold()
+
+
+def name_grams(name):
+    """ All substrings of up to GRAM_SIZE characters """
+    return {name[start:start + size] for size in range(1, GRAM_SIZE + 1) for start in range(len(name) - size + 1)}
+
+
+class NameIndex:
+    """
+    Normalised names and aliases of all players mapped to their player ids. Every name is indexed by its short
+    substrings (n-grams), so a search only checks the names that contain all n-grams of the search text.
+    """
+
+    def __init__(self):
+        self.player_ids = defaultdict(set)  # normalised name -> ids of the players that used it
+        self.grams = defaultdict(set)  # n-gram -> normalised names containing it
+        self.lengths = defaultdict(set)  # name length -> normalised names
+        self._normalised = {}  # raw name -> normalised name, names repeat in every snapshot
+
+    def add(self, player_id, name):
+        if name is None:
+            return
+        normalised = self._normalised.get(name)
+        if normalised is None:
+            normalised = self._normalised[name] = normalise_name(name)
+        if normalised not in self.player_ids:
+            for gram in name_grams(normalised):
+                self.grams[gram].add(normalised)
+            self.lengths[len(normalised)].add(normalised)
+        self.player_ids[normalised].add(player_id)
+
+    def add_player(self, player):
+        self.add(player.id, player.current_name)
+        for alias in player.aliases:
+            self.add(player.id, alias)
+
+    def matching_names(self, text, prefix=False):
+        """ Normalised names that contain the text (or start with it) """
+        text = normalise_name(text)
+        if not text:
+            return set(self.player_ids)
+        if len(text) <= GRAM_SIZE:
+            names = self.grams.get(text, set())
+        else:
+            # only names with the rarest n-gram of the text can contain it
+            candidates = min((self.grams.get(text[i:i + GRAM_SIZE], set()) for i in range(len(text) - GRAM_SIZE + 1)),
+                             key=len)
+            names = {name for name in candidates if text in name}
+        if prefix:
+            return {name for name in names if name.startswith(text)}
+        return names
+
+    def search(self, text, prefix=False):
+        """ Ids of the players with a name or alias that contains the text (or starts with it) """
+        return {player_id for name in self.matching_names(text, prefix) for player_id in self.player_ids[name]}
+
+    def similar_names(self, text, threshold):
+        """
+        Normalised text and the names that can reach the similarity ratio threshold (0-100) with it. The ratio is
+        200 * matches / total length and matches can not exceed the shorter name, so only names of similar length remain.
+        """
+        text = normalise_name(text)
+        # ratios get rounded, so a bound slightly below the threshold still counts
+        bound = threshold - 0.5
+        if not text or bound <= 0:
+            return text, list(self.player_ids)
+        shortest = math.ceil(len(text) * bound / (200 - bound))
+        longest = math.floor(len(text) * (200 - bound) / bound)
+        return text, [name for length in range(max(shortest, 1), longest + 1) for name in self.lengths.get(length, ())]
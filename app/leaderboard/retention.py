@@ -0,0 +1,62 @@
+from datetime import timedelta
+
+METRICS = ("mmr", "power", "total_wins")
+
+
+class RetentionPolicy:
+    """
+    Keeps every snapshot of the last full_days, the last one per hour up to hourly_days and per day before that. Without
+    hourly_days the last one per hour is kept for all older snapshots.
+    """
+
+    def __init__(self, full_days, hourly_days=None):
+        self.full_days = full_days
+        self.hourly_days = max(full_days, hourly_days) if hourly_days is not None else None
+
+    def kept_timestamps(self, timestamps):
+        """ Returns the snapshot timestamps to keep, the windows are relative to the latest snapshot """
+        if not timestamps:
+            return set()
+        latest = max(timestamps)
+        full_start = latest - timedelta(days=self.full_days)
+        hourly_start = latest - timedelta(days=self.hourly_days) if self.hourly_days is not None else None
+        kept = set()
+        buckets = {}
+        for timestamp in timestamps:
+            if timestamp >= full_start:
+                kept.add(timestamp)
+                continue
+            if hourly_start is None or timestamp >= hourly_start:
+                bucket = timestamp.replace(minute=0, second=0)
+            else:
+                bucket = timestamp.date()
+            if bucket not in buckets or buckets[bucket] < timestamp:
+                buckets[bucket] = timestamp
+        return kept | set(buckets.values())
+
+
+def retained_records(records, kept_timestamps):
+    """
+    Returns the records of kept snapshots sorted by time. Records of dropped snapshots stay if they hold the latest
+    metrics, a min/max metric or the first appearance of a name of the player, so its stats never change.
+    """
+    records = sorted(records, key=lambda r: r.timestamp)
+    if not records:
+        return records
+    protected = {id(records[-1])}
+    first_by_name = {}
+    for record in records:
+        first_by_name.setdefault(record.name, record)
+    protected.update(id(record) for record in first_by_name.values())
+    for metric in METRICS:
+        protected.add(id(max(records, key=lambda r: getattr(r.metrics, metric))))
+        protected.add(id(min(records, key=lambda r: getattr(r.metrics, metric))))
+    return [record for record in records if record.timestamp in kept_timestamps or id(record) in protected]
+
+
+def prune_leaderboard(leaderboard, retention):
+    """ Drops the snapshots the retention policy does not keep from the loaded records, returns the removed count """
+    removed = leaderboard.prune_snapshots(retention.kept_timestamps(leaderboard.snapshot_timestamps))
+    if removed:
+        print(f"Removed {removed} records of old snapshots")
+    return removed
@@ -0,0 +1,116 @@
+from collections import deque
+
+import numpy as np
+
+DIFF_HISTORY_SIZE = 1000
+
+
+class SnapshotDiff:
+    """ Changes of a snapshot compared to the one before it, players are given by id """
+    __slots__ = ("timestamp", "previous_timestamp", "entrants", "dropouts", "movers", "mmr_changes")
+
+    def __init__(self, timestamp, previous_timestamp, entrants, dropouts, movers, mmr_changes):
+        self.timestamp = timestamp
+        self.previous_timestamp = previous_timestamp
+        self.entrants = entrants  # ids of the players that were not in the previous snapshot
+        self.dropouts = dropouts  # ids of the players of the previous snapshot that are missing
+        self.movers = movers  # (id, ranks moved up) of the players whose rank changed, biggest moves first
+        self.mmr_changes = mmr_changes  # (id, mmr change) of the players whose mmr changed
+
+    def changed_players(self):
+        """ Ids of all players whose rows changed """
+        return set(self.entrants) | set(self.dropouts) | {player_id for player_id, _ in self.movers} | {
+            player_id for player_id, _ in self.mmr_changes}
+
+    def summary(self):
+        return (f"{len(self.entrants)} players entered, {len(self.dropouts)} left and {len(self.movers)} moved in the "
+                f"leaderboard")
+
+
+class SnapshotDiffs:
+    """
+    Diffs of consecutive snapshots. The ranks and mmr of the previous snapshot are kept in arrays indexed by a number
+    per player id, so a diff only touches the players of the two snapshots. The latest diffs are kept as history.
+    """
+
+    def __init__(self, history_size=DIFF_HISTORY_SIZE):
+        self.history = deque(maxlen=history_size)
+        self.timestamp = None  # of the previous snapshot
+        self.player_indices = {}
+        self.player_ids = []
+        self.ranks = np.zeros(0, dtype=np.int64)
+        self.mmr = np.zeros(0, dtype=np.int64)
+        self.is_member = np.zeros(0, dtype=bool)
+        self.members = np.zeros(0, dtype=np.int64)  # player indices of the previous snapshot
+
+    def indices(self, records):
+        """ Array index of every record's player, new players get the next free one """
+        indices = np.array([self.player_index(record.id) for record in records], dtype=np.int64)
+        if len(self.player_ids) > len(self.ranks):
+            # grow by doubling, so adding players stays cheap
+            missing = max(len(self.player_ids), 2 * len(self.ranks)) - len(self.ranks)
+            self.ranks = np.append(self.ranks, np.zeros(missing, dtype=np.int64))
+            self.mmr = np.append(self.mmr, np.zeros(missing, dtype=np.int64))
+            self.is_member = np.append(self.is_member, np.zeros(missing, dtype=bool))
+        return indices
+
+    def player_index(self, player_id):
+        index = self.player_indices.get(player_id)
+        if index is None:
+            index = self.player_indices[player_id] = len(self.player_ids)
+            self.player_ids.append(player_id)
+        return index
+
+    def reset(self, timestamp, records):
+        """ Starts from the snapshot without a diff, the next one gets compared to it """
+        indices = self.indices(records)
+        self.is_member[self.members] = False
+        self.ranks[indices] = [record.metrics.world_rank or 0 for record in records]
+        self.mmr[indices] = [record.metrics.mmr for record in records]
+        self.is_member[indices] = True
+        self.members = indices
+        self.timestamp = timestamp
+
+    def add(self, timestamp, records):
+        """ Compares the snapshot to the previous one, adds the diff to the history and returns it """
+        indices = self.indices(records)
+        ranks = np.array([record.metrics.world_rank or 0 for record in records], dtype=np.int64)
+        mmr = np.array([record.metrics.mmr for record in records], dtype=np.int64)
+
+        was_member = self.is_member[indices]
+        self.is_member[self.members] = False
+        self.is_member[indices] = True
+        dropouts = self.members[~self.is_member[self.members]]
+        entrants = indices[~was_member]
+
+        stayed = indices[was_member]
+        rank_changes = self.ranks[stayed] - ranks[was_member]
+        mmr_changes = mmr[was_member] - self.mmr[stayed]
+        movers = np.flatnonzero(rank_changes)
+        movers = movers[np.argsort(-np.abs(rank_changes[movers]), kind="stable")]
+        mmr_changed = np.flatnonzero(mmr_changes)
+
+        ids = self.player_ids
+        diff = SnapshotDiff(
+            timestamp, self.timestamp,
+            entrants=tuple(ids[i] for i in entrants.tolist()),
+            dropouts=tuple(ids[i] for i in dropouts.tolist()),
+            movers=tuple((ids[i], change) for i, change in zip(stayed[movers].tolist(), rank_changes[movers].tolist())),
+            mmr_changes=tuple((ids[i], change) for i, change in zip(stayed[mmr_changed].tolist(),
+                                                                     mmr_changes[mmr_changed].tolist()))
+        )
+        self.ranks[indices] = ranks
+        self.mmr[indices] = mmr
+        self.members = indices
+        self.timestamp = timestamp
+        self.history.append(diff)
+        return diff
+
+    def diffs_since(self, timestamp):
+        """ Diffs of the kept history that are newer than the timestamp, oldest first """
+        diffs = []
+        for diff in reversed(self.history):
+            if diff.timestamp <= timestamp:
+                break
+            diffs.append(diff)
+        return diffs[::-1]
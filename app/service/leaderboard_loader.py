@@ -0,0 +1,48 @@
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from app.leaderboard import leaderboard_manager
+
+
+class LeaderboardLoader(QObject):
+    """
+    Loads the saved leaderboard and merges new log records into it off the ui thread. The ui only gets the leaderboard
+    once it is complete, so it never sees one that is still being changed.
+    """
+    progress = pyqtSignal(str)
+    loaded = pyqtSignal(object, dict)
+    failed = pyqtSignal(str)
+    aborted = pyqtSignal()
+
+    def __init__(self, log_folder):
+        super().__init__()
+        self.progress: pyqtSignal
+        self.loaded: pyqtSignal
+        self.failed: pyqtSignal
+        self.aborted: pyqtSignal
+        self.log_folder = log_folder
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            self.load()
+        except Exception as e:
+            # the app keeps running with an empty leaderboard, but without importing or watching the logs
+            print(f"Could not load leaderboard: {e}")
+            self.aborted.emit()
+            self.failed.emit(f"Could not load the leaderboard: {e}")
+
+    def load(self):
+        self.progress.emit("Loading saved leaderboard...")
+        leaderboard = leaderboard_manager.load_saved_leaderboard()
+
+        self.progress.emit("Importing new records from game logs...")
+        new_leaderboard, checkpoints = leaderboard_manager.import_new_records(
+            leaderboard, self.log_folder, on_error=self.failed.emit)
+
+        self.progress.emit("Merging new records...")
+        leaderboard_manager.apply_imported_records(leaderboard, new_leaderboard)
+        self.loaded.emit(leaderboard, checkpoints)
@@ -0,0 +1,53 @@
+import queue
+import threading
+
+from app.leaderboard import leaderboard_manager
+
+SHUTDOWN_TIMEOUT = 5  # seconds
+
+
+class LeaderboardSaver:
+    """ Saves new leaderboard records and the log checkpoints on a background thread, in the order they were queued """
+
+    def __init__(self):
+        self._saves = queue.Queue()
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._last_checkpoints = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def save(self, leaderboard, checkpoints):
+        """ Queues the records added since the last save, nothing gets written if neither they nor checkpoints changed """
+        records, batches = leaderboard.take_unsaved()
+        if not records and not batches and checkpoints == self._last_checkpoints:
+            return
+        # the copy keeps later changes of the caller out of this save
+        self._last_checkpoints = dict(checkpoints)
+        with self._idle:
+            self._pending = self._pending + 1
+        self._saves.put((records, batches, self._last_checkpoints))
+
+    def flush(self, timeout=SHUTDOWN_TIMEOUT):
+        """ Waits until all queued saves are written, at most timeout seconds """
+        with self._idle:
+            if not self._idle.wait_for(lambda: self._pending == 0, timeout=timeout):
+                print(f"Gave up waiting for {self._pending} pending leaderboard saves")
+
+    def _run(self):
+        # records of failed saves get written again with the next one, no checkpoints are saved until they made it
+        unsaved_records, unsaved_batches = [], []
+        while True:
+            records, batches, checkpoints = self._saves.get()
+            unsaved_records.extend(records)
+            unsaved_batches.extend(batches)
+            try:
+                leaderboard_manager.write_records(unsaved_records, unsaved_batches)
+                unsaved_records, unsaved_batches = [], []
+                leaderboard_manager.write_checkpoints(checkpoints)
+            except Exception as e:
+                # keep the saver alive, if the app exits first the old checkpoints make the records get imported again
+                print(f"Could not save leaderboard: {e}")
+            with self._idle:
+                self._pending = self._pending - 1
+                self._idle.notify_all()
@@ -0,0 +1,55 @@
+import os
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from app.leaderboard import log_importer
+
+POLL_INTERVAL = 2  # seconds
+
+
+class LogWatcher(QObject):
+    """ Tails the newest game log in the background and emits every leaderboard snapshot the game writes to it """
+    snapshots_received = pyqtSignal(list, dict)
+
+    def __init__(self, log_folder, checkpoints=None):
+        super().__init__()
+        self.snapshots_received: pyqtSignal
+        self.log_folder = log_folder
+        self.checkpoints = dict(checkpoints or {})
+        self.known = log_importer.KnownSnapshots()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=POLL_INTERVAL)
+
+    def _run(self):
+        while not self._stop_event.wait(POLL_INTERVAL):
+            try:
+                self.poll()
+            except OSError as e:
+                print(f"Could not read game log: {e}")
+
+    def poll(self):
+        path = self.active_log()
+        if path is None:
+            return
+        filename = os.path.basename(path)
+        snapshots, self.checkpoints[filename], _ = log_importer.read_log_file(path, self.checkpoints.get(filename),
+                                                                              self.known)
+        if snapshots:
+            # snapshots get imported on the ui thread as invalid ones need to show an error, the checkpoints get
+            # saved together with them
+            self.snapshots_received.emit(snapshots, dict(self.checkpoints))
+
+    def active_log(self):
+        log_files = [os.path.join(self.log_folder, filename) for filename in os.listdir(self.log_folder)
+                     if filename.endswith(".txt")]
+        return max(log_files, key=os.path.getmtime, default=None)
@@ -13,9 +13,12 @@ from app.leaderboard.leaderboard import Leaderboard
 from app.service.state_manager import StateManager
 
 
-def is_fuzzy_match(target, candidates):
+def fuzzy_matches(read_name, leaderboard: Leaderboard):
+    """ Ids of the players with a name or alias similar to the read one, only names of similar length are compared """
     threshold = settings.get_settings().fuzzy_threshold
-    return any(fuzz.ratio(target.lower(), c.lower()) >= threshold for c in candidates)
+    read_name, candidates = leaderboard.name_index.similar_names(read_name, threshold)
+    return {player_id for name in candidates if fuzz.ratio(read_name, name) >= threshold
+            for player_id in leaderboard.name_index.player_ids[name]}
 
 
 def to_maked_image(image):
@@ -57,12 +60,9 @@ class PlayerDetector(QObject):
 
     @staticmethod
     def resolve_read_to_players(names, leaderboard: Leaderboard):
-        matches = []
-        for player in leaderboard.get_players():
-            if is_fuzzy_match(player.current_name, names) or any(
-                    is_fuzzy_match(alias, names) for alias in player.aliases):
-                matches.append(player)
-        return matches
+        leaderboard.get_players()  # indexes the names of new players
+        player_ids = set().union(*(fuzzy_matches(name, leaderboard) for name in names))
+        return sorted((leaderboard.get_player(player_id) for player_id in player_ids), key=lambda p: p.score_rank)
 
     def read_names_from_screen(self):
         # Take a screenshot
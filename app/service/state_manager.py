@@ -28,6 +28,17 @@ class StateManager:
             raise RuntimeError("StateManager not initialized!")
         return cls._instance
 
+    def set_leaderboard(self, leaderboard):
+        self.leaderboard = leaderboard
+        self.players = leaderboard.get_players()
+        # keep the selection but point it to the players of the new leaderboard
+        self.selected_players = self._resolve(self.selected_players)
+        self.left_players = self._resolve(self.left_players)
+        self.right_players = self._resolve(self.right_players)
+
+    def _resolve(self, players):
+        return [self.leaderboard.get_player(p.id) for p in players if self.leaderboard.get_player(p.id)]
+
     def reset_selected_players(self):
         self.selected_players = []
         self.left_players = []
@@ -39,8 +50,8 @@ class StateManager:
 
     def has_selection_warnings(self):
         # check if selected players are up-to-date
-        left = len(self.left_players) > 0 and all(not p.is_top_player for p in self.left_players)
-        right = len(self.right_players) > 0 and all(not p.is_top_player for p in self.right_players)
+        left = len(self.left_players) > 0 and not any(map(self.leaderboard.was_top_player, self.left_players))
+        right = len(self.right_players) > 0 and not any(map(self.leaderboard.was_top_player, self.right_players))
         return left or right
 
     def select_players(self, smart: [PlayerStats] = None, left: [PlayerStats] = None, right: [PlayerStats] = None):
@@ -158,6 +158,15 @@ class WidgetToolBar(QMainWindow):
         if self.gamble_window:
             self.gamble_window.update_view()
 
+    def set_leaderboard(self, leaderboard):
+        self.leaderboard = leaderboard
+        self.reopen_all_windows()
+
+    def notify_leaderboard_updated(self):
+        if self.picker_window:
+            self.picker_window.update_leaderboard()
+        self.update_views()
+
     def detect_player(self):
         self.detector_service.detect_player(self.leaderboard)
         self.update_views()
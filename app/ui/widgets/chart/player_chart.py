@@ -1,15 +1,25 @@
+import bisect
+from datetime import datetime, timedelta
+
 import matplotlib
 import matplotlib.pyplot as plt
 from PyQt5.QtCore import Qt, QEvent
 from PyQt5.QtGui import QIcon, QColor, QBrush
 from PyQt5.QtWidgets import QTableWidget, QTableWidgetItem, QHeaderView, QFrame, QVBoxLayout, QWidget, \
-    QMainWindow
+    QMainWindow, QComboBox
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg
 
 from app import statics
 from app.configuration import settings
 from app.service.state_manager import StateManager
 
+# plotted time ranges, relative to the latest snapshot
+CHART_RANGES = {
+    "All Time": None,
+    "Last Month": timedelta(days=30),
+    "Last Week": timedelta(weeks=1),
+    "Last Day": timedelta(days=1),
+}
 
 class PlayerChart(QMainWindow):
 
@@ -44,6 +54,18 @@ class PlayerChart(QMainWindow):
 
         self.leaderboard = leaderboard
 
+        # plotted value, the score of every snapshot is precalculated by the leaderboard
+        self.plot_selector = QComboBox(self)
+        self.plot_selector.addItems(["MMR", "Score"])
+        self.plot_selector.currentIndexChanged.connect(self.populate_plot)
+        self.selected_players_layout.addWidget(self.plot_selector)
+
+        # only the records within the plotted time range are read
+        self.range_selector = QComboBox(self)
+        self.range_selector.addItems(list(CHART_RANGES))
+        self.range_selector.currentIndexChanged.connect(self.populate_plot)
+        self.selected_players_layout.addWidget(self.range_selector)
+
         self.figure = plt.Figure(figsize=(6, 4))
         self.canvas = FigureCanvasQTAgg(self.figure)
         # self.canvas.setFixedHeight(200)
@@ -119,6 +141,12 @@ class PlayerChart(QMainWindow):
 
         self.table.resizeColumnsToContents()
 
+    def time_range(self):
+        """ Start and end of the plotted time range """
+        end = self.leaderboard.last_timestamp or datetime.max
+        time_range = CHART_RANGES[self.range_selector.currentText()]
+        return (end - time_range if time_range is not None else datetime.min), end
+
     def populate_plot(self):
         self.ax.clear()
         self.ax.set_facecolor('#2e2e2e')
@@ -126,14 +154,21 @@ class PlayerChart(QMainWindow):
         handles = []
         labels = []
 
+        start, end = self.time_range()
+        plotted_timestamps = self.leaderboard.timestamps[bisect.bisect_left(self.leaderboard.timestamps, start):]
         for player in StateManager.instance().selected_players:
-            # Create a dictionary of timestamp → mmr values
-            timestamp_to_mmr = {record.timestamp: record.metrics.mmr for record in player.records}
-
-            # Create a list of mmr values, inserting None for missing timestamps
-            mmr_values = [timestamp_to_mmr.get(ts, None) for ts in self.leaderboard.timestamps]
-
-            line, = self.ax.plot(self.leaderboard.timestamps, mmr_values, 'o-', label=f"{player.id}")
+            # Create a dictionary of timestamp → mmr or score values
+            if self.plot_selector.currentText() == "Score":
+                timestamps, scores, _ = self.leaderboard.player_score_history(player.id)
+                timestamp_to_value = dict(zip(timestamps, scores))
+            else:
+                timestamp_to_value = {record.timestamp: record.metrics.mmr
+                                      for record in player.records_between(start, end)}
+
+            # Create a list of values, inserting None for missing timestamps
+            values = [timestamp_to_value.get(ts, None) for ts in plotted_timestamps]
+
+            line, = self.ax.plot(plotted_timestamps, values, 'o-', label=f"{player.id}")
             handles.append(line)  # Add the line handle to the list
             labels.append(player.current_name)  # Use the player's name as the custom label
 
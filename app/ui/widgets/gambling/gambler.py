@@ -5,7 +5,7 @@ import numpy as np
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import (
-    QWidget, QPushButton, QLineEdit, QVBoxLayout, QHBoxLayout, QMainWindow, QTabWidget, QSlider, QProgressBar
+    QWidget, QPushButton, QLineEdit, QVBoxLayout, QHBoxLayout, QMainWindow, QTabWidget, QSlider, QProgressBar, QLabel
 )
 
 from app import statics
@@ -19,6 +19,13 @@ DATA_FILE = "recent_bets.json"
 MAX_BUTTONS = 5
 
 
+def rolling_stats_text(player):
+    """ Recent mmr trend, wins and estimated win rate of the player """
+    stats = player.rolling_stats
+    win_rate = f"~{stats.win_rate:.0%} won" if stats.win_rate is not None else "no games"
+    return f"{stats.mmr_per_hour:+.0f} mmr/h, {stats.wins} wins, {win_rate}"
+
+
 class Gambler(QMainWindow):
     def __init__(self, parent=None, leaderboard=None):
         super().__init__(parent=parent)
@@ -165,6 +172,15 @@ class Gambler(QMainWindow):
         self.player_score_progress_bar.setContentsMargins(0, 0, 0, 2)  # No outer margin
         stats_layout.addWidget(self.player_score_progress_bar)
 
+        # recent form of both players, the stats are kept up-to-date by the leaderboard
+        rolling_stats_layout = QHBoxLayout()
+        self.left_rolling_stats = QLabel(self)
+        self.right_rolling_stats = QLabel(self)
+        self.right_rolling_stats.setAlignment(Qt.AlignRight)
+        rolling_stats_layout.addWidget(self.left_rolling_stats)
+        rolling_stats_layout.addWidget(self.right_rolling_stats)
+        stats_layout.addLayout(rolling_stats_layout)
+
         self.warning_label = QLineEdit()
         self.warning_label.setText("⚠ Current selected player stats are not up-to-date and might be invalid")
         self.warning_label.setVisible(False)
@@ -222,6 +238,10 @@ class Gambler(QMainWindow):
             self.player_score_progress_bar.setValue(ratio)
         else:
             self.player_score_progress_bar.setVisible(False)
+        left_players = StateManager.instance().left_players
+        right_players = StateManager.instance().right_players
+        self.left_rolling_stats.setText(rolling_stats_text(left_players[0]) if left_players else "")
+        self.right_rolling_stats.setText(rolling_stats_text(right_players[0]) if right_players else "")
 
     def add_to_bet_amount(self, delta):
         self.update_text_field(self.get_bet_amount() + delta)
@@ -1,7 +1,9 @@
+from datetime import datetime, timedelta
+
 from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QIcon, QColor, QBrush
+from PyQt5.QtGui import QIcon, QColor, QBrush, QFont
 from PyQt5.QtWidgets import QTableWidget, QTableWidgetItem, QHeaderView, QFrame, QVBoxLayout, QLineEdit, \
-    QWidget, QMainWindow, QTabWidget
+    QWidget, QMainWindow, QTabWidget, QComboBox
 
 from app import statics
 from app.configuration import settings
@@ -9,6 +11,16 @@ import numpy as np
 
 from app.service.state_manager import StateManager
 
+COLUMN_NAMES = ["Name", "Score", "Rank", "MMR", "Power", "Wins", "Alias"]
+# leaderboards the picker can show, relative to the latest snapshot
+SNAPSHOT_TIMES = {
+    "Now": None,
+    "1 Hour Ago": timedelta(hours=1),
+    "1 Day Ago": timedelta(days=1),
+    "1 Week Ago": timedelta(weeks=1),
+    "1 Month Ago": timedelta(days=30),
+}
+
 
 class PlayerPicker(QMainWindow):
     def __init__(self, parent=None, on_select_callback=None, leaderboard=None):
@@ -38,6 +50,12 @@ class PlayerPicker(QMainWindow):
         self.search_input.textChanged.connect(self.refresh_tables)
         self.layout.addWidget(self.search_input)
 
+        # past leaderboards are the snapshot at or before the selected time
+        self.snapshot_selector = QComboBox(self)
+        self.snapshot_selector.addItems(list(SNAPSHOT_TIMES))
+        self.snapshot_selector.currentIndexChanged.connect(self.populate_leaderboard_table)
+        self.layout.addWidget(self.snapshot_selector)
+
         self.table_tabs = QTabWidget()
         self.leaderboard_tab = QWidget()
         self.selected_players_tab = QWidget()
@@ -60,26 +78,55 @@ class PlayerPicker(QMainWindow):
         self.layout.addWidget(self.table_tabs)
 
         self.leaderboard = leaderboard
+        # players that changed in the live snapshots of the last update get highlighted
+        self.diff_timestamp = self.leaderboard.last_timestamp or datetime.min
+        self.changed_players = set()
         self.players = self.leaderboard.get_players()
-        self.populate_table(table=self.leaderboard_table, players=self.players)
+        self.populate_leaderboard_table()
         self.populate_table(table=self.selected_table, players=StateManager.instance().selected_players)
 
     def on_table_clicked(self, item):
         player_id = item.data(Qt.UserRole)
         self.on_select_callback(player_id)
 
+    def populate_leaderboard_table(self):
+        snapshot_time = SNAPSHOT_TIMES[self.snapshot_selector.currentText()]
+        if snapshot_time is None or self.leaderboard.last_timestamp is None:
+            self.populate_table(table=self.leaderboard_table, players=self.players)
+        else:
+            records = self.leaderboard.snapshot_at(self.leaderboard.last_timestamp - snapshot_time)
+            self.populate_snapshot_table(table=self.leaderboard_table, records=records)
+
     def populate_table(self, table, players):
         filtered_players = self.filter_players(players)
+        self.prepare_table(table, len(filtered_players))
+        for row, player in enumerate(filtered_players):
+            score_widget = QTableWidgetItem(str(round(player.score, 2)))
+            score_widget.setForeground(QBrush(QColor(player.color)))
+            self.populate_row(table, row, player.id, player.current_name, score_widget, player.current_metrics,
+                              player.max_metrics.total_wins, player.aliases)
+        table.resizeColumnsToContents()
+
+    def populate_snapshot_table(self, table, records):
+        """ Rows of a past snapshot with the metrics of back then, scores are only known for the latest one """
+        filtered_records = self.filter_records(records)
+        self.prepare_table(table, len(filtered_records))
+        for row, record in enumerate(filtered_records):
+            player = self.leaderboard.get_player(record.id)
+            self.populate_row(table, row, record.id, record.name, QTableWidgetItem(""), record.metrics,
+                              record.metrics.total_wins, player.aliases if player else [])
+        table.resizeColumnsToContents()
+
+    def prepare_table(self, table, row_count):
         table.clearContents()
         table.setRowCount(0)
         table.setColumnCount(0)
 
-        column_names = ["Name", "Score", "Rank", "MMR", "Power", "Wins", "Alias"]
-        table.setColumnCount(len(column_names))
-        table.setHorizontalHeaderLabels(column_names)
+        table.setColumnCount(len(COLUMN_NAMES))
+        table.setHorizontalHeaderLabels(COLUMN_NAMES)
 
         header = table.horizontalHeader()
-        for i in range(len(column_names)):
+        for i in range(len(COLUMN_NAMES)):
             header.setSectionResizeMode(i, QHeaderView.ResizeMode.ResizeToContents)
         # stretch player names
         header.setSectionResizeMode(6, QHeaderView.ResizeMode.Stretch)
@@ -87,58 +134,76 @@ class PlayerPicker(QMainWindow):
         table.setEditTriggers(QTableWidget.NoEditTriggers)
         table.setSelectionBehavior(QTableWidget.SelectRows)
 
-        table.setRowCount(len(filtered_players))
+        table.setRowCount(row_count)
+
+    def populate_row(self, table, row, player_id, name, score_widget, metrics, total_wins, aliases):
         max_metrics = self.leaderboard.max_metrics
         min_metrics = self.leaderboard.min_metrics
-        for row, player in enumerate(filtered_players):
-            table.setItem(row, 0, QTableWidgetItem(player.current_name))
-
-            score_widget = QTableWidgetItem(str(round(player.score, 2)))
-            score_widget.setForeground(QBrush(QColor(player.color)))
-            table.setItem(row, 1, score_widget)
-
-            score_widget = QTableWidgetItem(str(round(player.current_metrics.world_rank, 2)))
-            world_percent = 1 - float(player.current_metrics.world_rank) / min_metrics.world_rank
-            score_widget.setForeground(QBrush(QColor(statics.calculate_color(world_percent))))
-            table.setItem(row, 2, score_widget)
-
-            score_widget = QTableWidgetItem(str(round(player.current_metrics.mmr, 2)))
-            world_percent = float(player.current_metrics.mmr - min_metrics.mmr) / (max_metrics.mmr - min_metrics.mmr)
-            score_widget.setForeground(QBrush(QColor(statics.calculate_color(world_percent))))
-            table.setItem(row, 3, score_widget)
-
-            score_widget = QTableWidgetItem(str(round(player.current_metrics.power, 2)))
-            world_percent = float(player.current_metrics.power - min_metrics.power) / (
-                    max_metrics.power - min_metrics.power)
-            score_widget.setForeground(QBrush(QColor(statics.calculate_color(world_percent))))
-            table.setItem(row, 4, score_widget)
-
-            score_widget = QTableWidgetItem(str(round(player.max_metrics.total_wins, 2)))
-            world_percent = float(player.current_metrics.total_wins - min_metrics.total_wins) / (
-                    max_metrics.total_wins - min_metrics.total_wins)
-            score_widget.setForeground(QBrush(QColor(statics.calculate_color(world_percent))))
-            table.setItem(row, 5, score_widget)
-
-            table.setItem(row, 6, QTableWidgetItem(", ".join(player.aliases)))
+        name_widget = QTableWidgetItem(name)
+        if player_id in self.changed_players:
+            font = QFont()
+            font.setBold(True)
+            name_widget.setFont(font)
+        table.setItem(row, 0, name_widget)
+
+        table.setItem(row, 1, score_widget)
+
+        score_widget = QTableWidgetItem(str(round(metrics.world_rank, 2)))
+        world_percent = 1 - float(metrics.world_rank) / min_metrics.world_rank
+        score_widget.setForeground(QBrush(QColor(statics.calculate_color(world_percent))))
+        table.setItem(row, 2, score_widget)
+
+        score_widget = QTableWidgetItem(str(round(metrics.mmr, 2)))
+        world_percent = float(metrics.mmr - min_metrics.mmr) / (max_metrics.mmr - min_metrics.mmr)
+        score_widget.setForeground(QBrush(QColor(statics.calculate_color(world_percent))))
+        table.setItem(row, 3, score_widget)
+
+        score_widget = QTableWidgetItem(str(round(metrics.power, 2)))
+        world_percent = float(metrics.power - min_metrics.power) / (
+                max_metrics.power - min_metrics.power)
+        score_widget.setForeground(QBrush(QColor(statics.calculate_color(world_percent))))
+        table.setItem(row, 4, score_widget)
+
+        score_widget = QTableWidgetItem(str(round(total_wins, 2)))
+        world_percent = float(metrics.total_wins - min_metrics.total_wins) / (
+                max_metrics.total_wins - min_metrics.total_wins)
+        score_widget.setForeground(QBrush(QColor(statics.calculate_color(world_percent))))
+        table.setItem(row, 5, score_widget)
+
+        table.setItem(row, 6, QTableWidgetItem(", ".join(aliases)))
 
         # Store player ID in table items
-        for row, player in enumerate(filtered_players):
-            for i in range(len(column_names)):
-                table.item(row, i).setData(Qt.UserRole, player.id)
-
-        table.resizeColumnsToContents()
+        for i in range(len(COLUMN_NAMES)):
+            table.item(row, i).setData(Qt.UserRole, player_id)
 
     def filter_players(self, players):
-        search_text = self.search_input.text().strip().lower()
-        if search_text:
-            return [player for player in players if
-                    search_text in player.current_name.lower() or any(
-                        search_text in alias.lower() for alias in player.aliases)]
-        return players
+        search_text = self.search_input.text().strip()
+        if not search_text:
+            return players
+        if players is self.players:
+            return self.leaderboard.find_players(search_text)
+        matches = self.leaderboard.name_index.search(search_text)
+        return [player for player in players if player.id in matches]
+
+    def filter_records(self, records):
+        search_text = self.search_input.text().strip()
+        if not search_text:
+            return records
+        matches = self.leaderboard.name_index.search(search_text)
+        return [record for record in records if record.id in matches]
 
     def refresh_tables(self):
-        self.populate_table(table=self.leaderboard_table, players=self.players)
+        self.populate_leaderboard_table()
         self.populate_table(table=self.selected_table, players=StateManager.instance().selected_players)
 
+    def update_leaderboard(self):
+        diffs = self.leaderboard.snapshot_diffs.diffs_since(self.diff_timestamp)
+        if diffs:
+            self.diff_timestamp = diffs[-1].timestamp
+            self.changed_players = set().union(*(diff.changed_players() for diff in diffs))
+            self.statusBar().showMessage(diffs[-1].summary())
+        self.players = self.leaderboard.get_players()
+        self.populate_leaderboard_table()
+
     def update_view(self):
         self.populate_table(table=self.selected_table, players=StateManager.instance().selected_players)
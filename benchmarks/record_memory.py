@@ -0,0 +1,85 @@
+"""
+Measures the memory used per leaderboard record, compared to the former model of plain classes with a copy of the
+id, name and timestamp in every record.
+
+Usage: python benchmarks/record_memory.py [snapshots]
+"""
+import json
+import os
+import random
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.leaderboard.leaderboard import Leaderboard, SnapshotBatch  # noqa: E402
+
+PLAYERS_PER_SNAPSHOT = 200
+
+
+class LegacyMetricDataPoint:
+    def __init__(self, mmr, power, world_rank=None, total_wins=None):
+        self.world_rank = world_rank
+        self.mmr = mmr
+        self.power = power
+        self.total_wins = total_wins if total_wins is not None else 0
+
+
+class LegacyPlayerRecord:
+    def __init__(self, id, timestamp, metrics, name=None):
+        self.id = id
+        self.name = name
+        self.metrics = metrics
+        self.timestamp = timestamp
+
+
+def snapshot_rows(snapshots, seed=1):
+    """ Decoded snapshot rows, every snapshot has its own string objects like after json.loads """
+    rnd = random.Random(seed)
+    player_ids = [str(10000000 + i) for i in range(PLAYERS_PER_SNAPSHOT * 3)]
+    timestamp = datetime(2025, 1, 1)
+    for _ in range(snapshots):
+        timestamp = timestamp + timedelta(minutes=rnd.randint(5, 60))
+        rows = [(player_id, "Player" + player_id, rnd.randint(1000, 5000), rnd.randint(1000, 20000), rank,
+                 rnd.randint(0, 3000)) for rank, player_id in enumerate(rnd.sample(player_ids, PLAYERS_PER_SNAPSHOT))]
+        yield timestamp, json.loads(json.dumps(rows))
+
+
+def legacy_records(snapshots):
+    records = []
+    for timestamp, rows in snapshot_rows(snapshots):
+        for player_id, name, mmr, power, world_rank, total_wins in rows:
+            record_timestamp = datetime.strptime(timestamp.strftime("%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S")
+            records.append(LegacyPlayerRecord(player_id, record_timestamp,
+                                              LegacyMetricDataPoint(mmr, power, world_rank, total_wins), name))
+    return records
+
+
+def leaderboard_records(snapshots):
+    leaderboard = Leaderboard()
+    for timestamp, rows in snapshot_rows(snapshots):
+        leaderboard.add_batch(SnapshotBatch(timestamp, *map(list, zip(*rows))))
+    leaderboard.mark_saved()
+    leaderboard.update_metrics()
+    return leaderboard
+
+
+def bytes_per_record(build, snapshots):
+    tracemalloc.start()
+    result = build(snapshots)
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return used / (snapshots * PLAYERS_PER_SNAPSHOT)
+
+
+def main():
+    snapshots = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print(f"{snapshots} snapshots, {snapshots * PLAYERS_PER_SNAPSHOT} records")
+    print(f"before: {bytes_per_record(legacy_records, snapshots):.0f} bytes per record")
+    print(f"after:  {bytes_per_record(leaderboard_records, snapshots):.0f} bytes per record")
+
+
+if __name__ == "__main__":
+    main()
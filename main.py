@@ -1,4 +1,5 @@
 import asyncio
+import multiprocessing
 import os
 import sys
 import qdarktheme
@@ -8,7 +9,13 @@ from PyQt5.QtGui import QPixmap
 from PyQt5.QtWidgets import QApplication, QSplashScreen
 import threading
 
+from app import statics
+from app.configuration import settings
 from app.leaderboard import leaderboard_manager
+from app.leaderboard.leaderboard import Leaderboard
+from app.service.leaderboard_loader import LeaderboardLoader
+from app.service.leaderboard_saver import LeaderboardSaver
+from app.service.log_watcher import LogWatcher
 from app.service.player_detector import PlayerDetector
 from app.service.state_manager import StateManager
 from app.ui.widget_tool_bar import WidgetToolBar
@@ -25,18 +32,56 @@ class App(QApplication):
         self.detector.ready.connect(self.on_detector_ready)
 
         # TODO: make leaderboard a singleton
-        self.leaderboard = leaderboard_manager.load_leaderboard()
+        # starts empty, the loaded leaderboard gets swapped in once the new log records are merged into it
+        self.leaderboard = Leaderboard()
         self.state_manager = StateManager.init(leaderboard=self.leaderboard)
         self.widget_tool_bar = WidgetToolBar(application=self, leaderboard=self.leaderboard)
         # pywinstyles.apply_style(demo, "aero")
         pywinstyles.apply_style(self.widget_tool_bar, "dark")
-        self.splash.finish(None)
         self.widget_tool_bar.show()
 
+        # load saved leaderboard and import new log records in the background
+        self.log_folder = settings.game_log_filepath()
+        self.log_watcher = None
+        self.saver = LeaderboardSaver()
+        self.aboutToQuit.connect(self.saver.flush)
+        self.loader = LeaderboardLoader(self.log_folder)
+        self.loader.progress.connect(self.show_progress)
+        self.loader.loaded.connect(self.on_leaderboard_loaded)
+        self.loader.failed.connect(statics.show_error)
+        self.loader.aborted.connect(self.on_loading_aborted)
+        self.loader.start()
+
+    def show_progress(self, message):
+        self.splash.showMessage(message, Qt.AlignBottom | Qt.AlignHCenter, Qt.white)
+
+    def on_leaderboard_loaded(self, leaderboard, checkpoints):
+        self.leaderboard = leaderboard
+        StateManager.instance().set_leaderboard(leaderboard)
+        self.widget_tool_bar.set_leaderboard(leaderboard)
+        self.saver.save(self.leaderboard, checkpoints)
+        self.widget_tool_bar.notify_leaderboard_updated()
+        self.splash.finish(self.widget_tool_bar)
+
+        # pick up new leaderboard snapshots while the game is running
+        self.log_watcher = LogWatcher(self.log_folder, checkpoints)
+        self.log_watcher.snapshots_received.connect(self.on_snapshots_received)
+        self.aboutToQuit.connect(self.log_watcher.stop)
+        self.log_watcher.start()
+
+    def on_loading_aborted(self):
+        self.widget_tool_bar.notify_leaderboard_updated()
+        self.splash.finish(self.widget_tool_bar)
+
     def on_detector_ready(self):
         print("detector is ready!")
         self.widget_tool_bar.notify_detector_ready(self.detector)
 
+    def on_snapshots_received(self, snapshots, checkpoints):
+        if leaderboard_manager.import_snapshots(self.leaderboard, snapshots):
+            self.widget_tool_bar.notify_leaderboard_updated()
+        self.saver.save(self.leaderboard, checkpoints)
+
 
 def init_thread(loop, app):
     asyncio.set_event_loop(loop)
@@ -50,6 +95,9 @@ def restart():
 
 
 if __name__ == "__main__":
+    # log import workers are spawned from the frozen executable
+    multiprocessing.freeze_support()
+
     App.setHighDpiScaleFactorRoundingPolicy(Qt.HighDpiScaleFactorRoundingPolicy.PassThrough)
     App.setAttribute(Qt.AA_EnableHighDpiScaling)
     App.setAttribute(Qt.AA_UseHighDpiPixmaps)